@@ -0,0 +1,144 @@
+import json
+import math
+
+# Mounting calibration: the rotation from the sensor's axes to the bike's,
+# stored as a quaternion (w, x, y, z) in a small JSON file and applied by
+# MPU6050.setMountingQuaternion, see there for how.
+
+IDENTITY = (1.0, 0.0, 0.0, 0.0)
+
+def multiply(a, b):
+	aw, ax, ay, az = a
+	bw, bx, by, bz = b
+	return (aw * bw - ax * bx - ay * by - az * bz,
+		aw * bx + ax * bw + ay * bz - az * by,
+		aw * by - ax * bz + ay * bw + az * bx,
+		aw * bz + ax * by - ay * bx + az * bw)
+
+def conjugate(q):
+	return (q[0], -q[1], -q[2], -q[3])
+
+def normalize(q):
+	norm = math.sqrt(sum(value * value for value in q))
+	return tuple(value / norm for value in q)
+
+def rotate(q, v):
+	# v rotated by q, for a mounting q this turns a vector on the bike's axes
+	# back to the sensor's
+	w, x, y, z = multiply(multiply(q, (0.0,) + tuple(v)), conjugate(q))
+	return (x, y, z)
+
+def cross(a, b):
+	return (a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2], a[0] * b[1] - a[1] * b[0])
+
+def dot(a, b):
+	return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+def fromGravity(gx, gy, gz):
+	# Mounting that makes the gravity direction (gx, gy, gz), measured on the
+	# sensor's axes at rest, read as level: the shortest rotation from
+	# (gx, gy, gz) to (0, 0, 1)
+	gx, gy, gz = normalize((gx, gy, gz))
+	if gz < -0.9999:
+		# upside down, any horizontal axis will do
+		return (0.0, 1.0, 0.0, 0.0)
+	return normalize((1 + gz, -gy, gx, 0.0))
+
+def fromAxes(xAxis, yAxis, zAxis):
+	# Mounting for the bike's x (roll), y (pitch) and z (up) axes given as
+	# unit vectors on the sensor's axes
+	(m00, m01, m02), (m10, m11, m12), (m20, m21, m22) = xAxis, yAxis, zAxis
+	trace = m00 + m11 + m22
+	if trace > 0:
+		s = 2 * math.sqrt(1 + trace)
+		q = (s / 4, (m12 - m21) / s, (m20 - m02) / s, (m01 - m10) / s)
+	elif m00 > m11 and m00 > m22:
+		s = 2 * math.sqrt(1 + m00 - m11 - m22)
+		q = ((m12 - m21) / s, s / 4, (m10 + m01) / s, (m20 + m02) / s)
+	elif m11 > m22:
+		s = 2 * math.sqrt(1 + m11 - m00 - m22)
+		q = ((m20 - m02) / s, (m10 + m01) / s, s / 4, (m21 + m12) / s)
+	else:
+		s = 2 * math.sqrt(1 + m22 - m00 - m11)
+		q = ((m01 - m10) / s, (m20 + m02) / s, (m21 + m12) / s, s / 4)
+	return normalize(q)
+
+def fromTwoPoses(upright, sideStand, minimumLean = 5.0):
+	# Full mounting, yaw included, from the gravity directions measured on the
+	# sensor's axes with the bike upright and leant over to the left on its
+	# side stand. Upright gives the bike's vertical, the lean between the two
+	# poses happens about its forward axis. None when the bike was not leant
+	# over by minimumLean degrees.
+	up = normalize(upright)
+	sideStand = normalize(sideStand)
+
+	cosLean = dot(sideStand, up)
+	if math.degrees(math.acos(max(-1.0, min(1.0, cosLean)))) < minimumLean:
+		return None
+
+	# a lean to the left reads as negative roll, so gravity on the side stand
+	# points away from the bike's y axis
+	yAxis = normalize(tuple(cosLean * up[i] - sideStand[i] for i in range(3)))
+	return fromAxes(cross(yAxis, up), yAxis, up)
+
+def gravityFromPitchRoll(pitch, roll):
+	# Unit gravity for the pitch and roll (degrees) reported at rest, inverting
+	# the formulas of MPU6050.dmpGetYawPitchRoll
+	gx = math.sin(math.radians(pitch))
+	gy = math.sin(math.radians(roll))
+	gz = math.sqrt(max(1 - gx * gx - gy * gy, 0))
+	return (gx, gy, gz)
+
+class TwoPoseCalibration:
+	"""Guides through the two poses of fromTwoPoses, one switch press each.
+	The upright pose alone already levels pitch and roll, the side stand adds
+	the yaw of the mounting. An upright pose not followed by the side stand
+	within timeout seconds is dropped, the next press starts over."""
+
+	prompts = ("Hold the bike upright and press the switch",
+		"Put the bike on its side stand and press the switch")
+
+	def __init__(self, minimumLean = 5.0, timeout = 30.0):
+		self.minimumLean = minimumLean
+		self.timeout = timeout
+
+		# gravity on the sensor's axes with the bike upright and when it was
+		# taken, None until taken
+		self.upright = None
+		self.uprightTime = None
+
+	def getPrompt(self):
+		return self.prompts[0 if self.upright is None else 1]
+
+	def addPose(self, gravity, now):
+		# Takes the next pose from gravity on the sensor's axes at now
+		# (seconds) and returns the mounting to apply now
+		if self.upright is not None and now - self.uprightTime > self.timeout:
+			self.upright = None
+
+		if self.upright is not None:
+			mounting = fromTwoPoses(self.upright, gravity, self.minimumLean)
+			if mounting is not None:
+				self.upright = None
+				return mounting
+
+		# first pose, or not leant over enough to be the side stand: start
+		# again from this pose as the upright one
+		self.upright = gravity
+		self.uprightTime = now
+		return fromGravity(*gravity)
+
+def load(path):
+	# The mounting quaternion saved in path, None when there is none
+	try:
+		with open(path) as f:
+			mounting = json.load(f)["mounting"]
+	except (IOError, ValueError, KeyError):
+		print "No calibration loaded from " + path
+		return None
+
+	return normalize(mounting)
+
+def save(path, mounting):
+	with open(path, "w") as f:
+		json.dump({"mounting" : list(mounting)}, f)
@@ -0,0 +1,277 @@
+"""Compact, lossless storage for session recordings (see SessionRecorder).
+
+python CompactSession.py session.rec...            writes session.rec.lrz
+python CompactSession.py --expand session.rec.lrz  writes session.rec back
+
+Records are stored in blocks of blockSize. Within a block every field is
+stored as a column of deltas from the previous record: the 21 big-endian
+int16 words of the DMP packet, the time and the float fields as their bit
+patterns. The slowly changing columns turn into runs of small numbers that
+zlib (or lzma where available) packs tightly. Blocks decode one at a time,
+so a file can be streamed, and round-trip exactly to the original records.
+
+File layout: header (magic, version, block size), then blocks of
+(codec, record count, compressed length) followed by the compressed data."""
+
+import os
+import sys
+import zlib
+from bisect import bisect_right
+from struct import Struct
+
+try:
+	import lzma
+except ImportError:
+	lzma = None
+
+import SessionRecorder
+
+MAGIC = "LEANLRZ1"
+VERSION = 1
+
+CODEC_ZLIB = 1
+CODEC_LZMA = 2
+
+headerStruct = Struct('<8sII')
+blockStruct = Struct('<BII')
+
+PACKET_WORDS = SessionRecorder.SessionRecorder.PACKET_SIZE // 2
+FLOAT_FIELDS = 5
+
+packetWordsStruct = Struct('>%dH' % PACKET_WORDS)
+floatBitsStruct = Struct('<%dI' % FLOAT_FIELDS)
+floatStruct = Struct('<%df' % FLOAT_FIELDS)
+timeBitsStruct = Struct('<Q')
+timeStruct = Struct('<d')
+
+def compress(data, codec):
+	if codec == CODEC_LZMA:
+		return lzma.compress(data)
+	return zlib.compress(data, 9)
+
+def decompress(data, codec):
+	if codec == CODEC_LZMA:
+		if lzma is None:
+			raise ValueError("lzma is needed to read this file")
+		return lzma.decompress(data)
+	return zlib.decompress(data)
+
+def deltaEncode(column, mask):
+	# Differences from the previous value, wrapped to the column's width
+	previous = 0
+	deltas = []
+	for value in column:
+		deltas.append((value - previous) & mask)
+		previous = value
+	return deltas
+
+def deltaDecode(deltas, mask):
+	previous = 0
+	column = []
+	for delta in deltas:
+		previous = (previous + delta) & mask
+		column.append(previous)
+	return column
+
+def encodeBlock(records):
+	# (time, packet, yaw, pitch, roll, rollRate, lateralAccel) records to the
+	# uncompressed block: time column, packet word columns, float field columns
+	count = len(records)
+	times = [timeBitsStruct.unpack(timeStruct.pack(record[0]))[0] for record in records]
+	words = [packetWordsStruct.unpack(record[1]) for record in records]
+	floats = [floatBitsStruct.unpack(floatStruct.pack(*record[2:])) for record in records]
+
+	parts = [Struct('<%dQ' % count).pack(*deltaEncode(times, 0xFFFFFFFFFFFFFFFF))]
+
+	columnStruct = Struct('<%dH' % count)
+	for column in zip(*words):
+		parts.append(columnStruct.pack(*deltaEncode(column, 0xFFFF)))
+
+	columnStruct = Struct('<%dI' % count)
+	for column in zip(*floats):
+		parts.append(columnStruct.pack(*deltaEncode(column, 0xFFFFFFFF)))
+
+	return "".join(parts)
+
+def decodeBlock(data, count):
+	pos = 0
+
+	columnStruct = Struct('<%dQ' % count)
+	times = deltaDecode(columnStruct.unpack_from(data, pos), 0xFFFFFFFFFFFFFFFF)
+	pos += columnStruct.size
+
+	columnStruct = Struct('<%dH' % count)
+	words = []
+	for i in range(PACKET_WORDS):
+		words.append(deltaDecode(columnStruct.unpack_from(data, pos), 0xFFFF))
+		pos += columnStruct.size
+
+	columnStruct = Struct('<%dI' % count)
+	floats = []
+	for i in range(FLOAT_FIELDS):
+		floats.append(deltaDecode(columnStruct.unpack_from(data, pos), 0xFFFFFFFF))
+		pos += columnStruct.size
+
+	records = []
+	for i, packetWords in enumerate(zip(*words)):
+		time = timeStruct.unpack(timeBitsStruct.pack(times[i]))[0]
+		values = floatStruct.unpack(floatBitsStruct.pack(*[column[i] for column in floats]))
+		records.append((time, packetWordsStruct.pack(*packetWords)) + values)
+
+	return records
+
+class CompactSessionWriter:
+	"""Writes records to a compact session file a block at a time"""
+
+	def __init__(self, path, blockSize = 1024, codec = None):
+		if codec is None:
+			codec = CODEC_LZMA if lzma is not None else CODEC_ZLIB
+
+		self.file = open(path, "wb")
+		self.blockSize = blockSize
+		self.codec = codec
+		self.records = []
+
+		self.file.write(headerStruct.pack(MAGIC, VERSION, blockSize))
+
+	def add(self, record):
+		self.records.append(record)
+		if len(self.records) == self.blockSize:
+			self.writeBlock()
+
+	def writeBlock(self):
+		if not self.records:
+			return
+
+		data = compress(encodeBlock(self.records), self.codec)
+		self.file.write(blockStruct.pack(self.codec, len(self.records), len(data)))
+		self.file.write(data)
+		self.records = []
+
+	def close(self):
+		self.writeBlock()
+		self.file.close()
+
+def readBlockTable(f, path):
+	# (data position, codec, record count, compressed length) of every block
+	# of an open compact session file, from the block headers alone
+	magic, version, blockSize = headerStruct.unpack(f.read(headerStruct.size))
+	if magic != MAGIC:
+		raise ValueError(path + " is not a compact session recording")
+
+	size = os.fstat(f.fileno()).st_size
+	blocks = []
+	while True:
+		header = f.read(blockStruct.size)
+		if len(header) < blockStruct.size:
+			return blocks
+
+		codec, count, length = blockStruct.unpack(header)
+		position = f.tell()
+
+		# a block cut short by a writer that never closed the file
+		if position + length > size:
+			return blocks
+
+		blocks.append((position, codec, count, length))
+		f.seek(length, os.SEEK_CUR)
+
+def readBlock(f, block):
+	position, codec, count, length = block
+	f.seek(position)
+	return decodeBlock(decompress(f.read(length), codec), count)
+
+def readBlocks(path, first = 0):
+	# Yields the records of a compact session file a block at a time, starting
+	# with the block holding record number first. Blocks before it are
+	# skipped without decompressing them.
+	with open(path, "rb") as f:
+		pos = 0
+		for block in readBlockTable(f, path):
+			if pos + block[2] > first:
+				yield readBlock(f, block)
+			pos += block[2]
+
+class CompactSessionFile:
+	"""Random access to the records of a compact session file like
+	SessionRecorder.SessionFile, decompressing one block at a time"""
+
+	def __init__(self, path):
+		self.path = path
+		self.file = open(path, "rb")
+		self.blocks = readBlockTable(self.file, path)
+
+		# number of the first record of every block
+		self.starts = []
+		self.count = 0
+		for block in self.blocks:
+			self.starts.append(self.count)
+			self.count += block[2]
+
+		self.blockNumber = None
+		self.blockRecords = None
+
+	def __len__(self):
+		return self.count
+
+	def __getitem__(self, i):
+		number = bisect_right(self.starts, i) - 1
+		if number != self.blockNumber:
+			self.blockRecords = readBlock(self.file, self.blocks[number])
+			self.blockNumber = number
+		return self.blockRecords[i - self.starts[number]]
+
+	def getTime(self, i):
+		return self[i][0]
+
+	def close(self):
+		self.file.close()
+
+def readRecords(path):
+	# All records of a compact session file, like SessionRecorder.readRecords
+	records = []
+	for block in readBlocks(path):
+		records.extend(block)
+	return records
+
+def compressSession(path, outPath = None, blockSize = 1024, codec = None):
+	if outPath is None:
+		outPath = path + ".lrz"
+
+	writer = CompactSessionWriter(outPath, blockSize, codec)
+	for record in SessionRecorder.readRecords(path):
+		writer.add(record)
+	writer.close()
+	return outPath
+
+def expandSession(path, outPath = None):
+	# Writes a compact file back out as a plain session file
+	if outPath is None:
+		outPath = path[:-len(".lrz")] if path.endswith(".lrz") else path + ".rec"
+
+	recorder = SessionRecorder.SessionRecorder
+	count = 0
+	with open(outPath, "wb") as f:
+		f.write("\0" * recorder.headerStruct.size)
+		for block in readBlocks(path):
+			for record in block:
+				f.write(recorder.recordStruct.pack(*record))
+			count += len(block)
+
+		f.seek(0)
+		f.write(recorder.headerStruct.pack(recorder.MAGIC, recorder.VERSION, recorder.recordStruct.size, count))
+
+	return outPath
+
+if __name__ == "__main__":
+	args = sys.argv[1:]
+	expand = args and args[0] == "--expand"
+	if expand:
+		args = args[1:]
+
+	for path in args:
+		if expand:
+			outPath = expandSession(path)
+		else:
+			outPath = compressSession(path)
+		print("%s: %d -> %d bytes" % (outPath, os.path.getsize(path), os.path.getsize(outPath)))
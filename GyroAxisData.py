@@ -1,4 +1,6 @@
-class GyroAxisData:
+class GyroAxisData(object):
+    __slots__ = ("axis", "val", "time")
+
     def __init__(self, inAxis, inVal, inTime):
         self.axis = inAxis
         self.val = inVal
@@ -0,0 +1,140 @@
+import time
+
+class GyroBiasCalibration:
+	"""Keeps the gyro user offset registers of an MPU6050 trimmed to the chip's
+	bias. The chip applies the offsets itself, so the correction costs
+	nothing per sample and the DMP integrates the corrected rates.
+
+	Once the bike looks at rest for stillChecks checks in a row, raw gyro
+	readings are averaged over a burst of sampleCount, one read per update()
+	so acquisition carries on in between. What the average still shows is the
+	bias the offsets don't cancel yet, it is added to them. A burst is thrown
+	away when the bike moved before it ended, its readings spread more than
+	maxSpread deg/s or it shows more than maxBias deg/s on an axis.
+
+	The zero-motion detection only watches the high passed accelerometer, it
+	also reports a steady corner. roll, a function returning the fused roll in
+	degrees off the mounting, must then stay within maxRoll of upright so the
+	turn isn't taken for bias."""
+
+	def __init__(self, mpu, sampleCount = 64, maxSpread = 2.0, checkInterval = 0.5, recalibrateInterval = 30.0,
+		zeroMotionThreshold = 156, clock = time.time, roll = None, maxRoll = 10.0, maxBias = 5.0, stillChecks = 3):
+		self.mpu = mpu
+		self.sampleCount = sampleCount
+		self.maxSpread = maxSpread
+		self.maxBias = maxBias
+
+		self.roll = roll
+		self.maxRoll = maxRoll
+
+		# checks in a row the bike looked still, a burst starts at stillChecks
+		self.stillChecks = stillChecks
+		self.stillCount = 0
+
+		# seconds between zero-motion checks, and after a calibration before the next
+		self.checkInterval = checkInterval
+		self.recalibrateInterval = recalibrateInterval
+		self.clock = clock
+
+		# dmpInitialize sets the same threshold, the raw engine none. The high
+		# pass filter only feeds motion detection, the sensor registers don't
+		# go through it. The detection status is polled, the zero-motion
+		# interrupt stays off so it doesn't wake the sampler like new data.
+		mpu.setZeroMotionDetectionThreshold(zeroMotionThreshold)
+		mpu.setDHPFMode(mpu.MPU6050_DHPF_5)
+
+		# (x, y, z) raw readings of the burst in progress
+		self.samples = []
+		self.nextCheck = 0
+
+		# number of times the offsets were updated, and to what
+		self.calibrations = 0
+		self.offsets = None
+
+	def update(self):
+		# Does at most a few bus transfers, returns True when the offsets changed
+		now = self.clock()
+		if not self.samples:
+			if now < self.nextCheck:
+				return False
+			self.nextCheck = now + self.checkInterval
+
+			if not self.isStill():
+				self.stillCount = 0
+				return False
+
+			self.stillCount += 1
+			if self.stillCount < self.stillChecks:
+				return False
+
+		rotation = self.mpu.getRotation()
+		if rotation == -1:
+			self.samples = []
+			return False
+
+		self.samples.append(rotation)
+		if len(self.samples) < self.sampleCount:
+			return False
+
+		samples, self.samples = self.samples, []
+		if not self.isStill():
+			self.stillCount = 0
+			return False
+
+		return self.applyBurst(samples, now)
+
+	def isStill(self):
+		if self.mpu.getZeroMotionDetected() != 1:
+			return False
+		return self.roll is None or abs(self.roll()) <= self.maxRoll
+
+	def applyBurst(self, samples, now):
+		gyroRange = self.mpu.getFullScaleGyroRange()
+		offsets = self.mpu.getGyroOffsetUser()
+		if gyroRange == -1 or offsets == -1:
+			return False
+
+		lsbPerDps = self.mpu.MPU6050_GYRO_LSB_PER_DPS / (1 << gyroRange)
+
+		newOffsets = []
+		for axis, values in enumerate(zip(*samples)):
+			if (max(values) - min(values)) / lsbPerDps > self.maxSpread:
+				return False
+
+			bias = float(sum(values)) / len(values) / lsbPerDps
+			if abs(bias) > self.maxBias:
+				return False
+
+			offset = int(round(offsets[axis] - bias * self.mpu.MPU6050_GYRO_OFFSET_LSB_PER_DPS))
+			newOffsets.append(max(-32768, min(32767, offset)))
+
+		self.mpu.setGyroOffsetUser(*newOffsets)
+		self.offsets = tuple(newOffsets)
+		self.calibrations += 1
+		self.stillCount = 0
+		self.nextCheck = now + self.recalibrateInterval
+		return True
+
+if __name__ == "__main__":
+	# Checks a steady corner against a standstill on the simulated device
+	import SimulatedMPU6050
+	import GyroscopeHardware
+
+	def run(motion, duration = 2.0):
+		sim = SimulatedMPU6050.SimulatedMPU6050(motion = motion, gyroBias = (1.5, -0.8, 0.3))
+		gyro = GyroscopeHardware.GyroscopeHardware(bus = sim, drainFIFO = True)
+		gyro.biasCalibration.checkInterval = 0.1
+
+		startTime = time.time()
+		while time.time() - startTime < duration:
+			gyro.update()
+			time.sleep(0.002)
+		return gyro.biasCalibration
+
+	still = run(SimulatedMPU6050.stationaryMotion())
+	print("standstill: %d calibrations, offsets %s" % (still.calibrations, still.offsets))
+	assert still.calibrations > 0
+
+	corner = run(SimulatedMPU6050.steadyCornerMotion())
+	print("steady corner: %d calibrations, offsets %s" % (corner.calibrations, corner.offsets))
+	assert corner.calibrations == 0
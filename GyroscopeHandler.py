@@ -1,15 +1,33 @@
 import time
-from operator import attrgetter
 
 import GyroscopeHardware
+import GyroscopeSampler
 import GyroAxisData
+import SlidingWindowMax
+import LeanStatistics
+import OutlierFilter
+import Calibration
 
 class GyroscopeHandler:
 
-	def __init__(self, switch, deltaThreshold, selfCorrectingThreshold):
-		self.gyroscopeHardware = GyroscopeHardware.GyroscopeHardware()
+	def __init__(self, switch, deltaThreshold, selfCorrectingThreshold, gyroscopeHardware = None, leanHorizons = None, statisticsPath = None, outlierWindow = 5, clock = time.time, calibrationPath = None):
+		# By default the hardware is read on a background thread, anything with
+		# update() and yaw/pitch/roll attributes can be passed in instead
+		if gyroscopeHardware is None:
+			gyroscopeHardware = GyroscopeSampler.GyroscopeSampler(GyroscopeHardware.GyroscopeHardware())
+			gyroscopeHardware.start()
+
+		self.gyroscopeHardware = gyroscopeHardware
 		self.switch = switch
 
+		# current time in seconds, a ReplaySource supplies the recorded time
+		self.clock = clock
+
+		# the mounting calibration taken with the switch is kept here, the
+		# hardware should be created with it already loaded (see Calibration.load)
+		self.calibrationPath = calibrationPath
+		self.mountingCalibration = Calibration.TwoPoseCalibration()
+
 		self.rollOffset = 0
 		self.pitchOffset = 0
 		self.yawOffset = 0
@@ -18,21 +36,41 @@ class GyroscopeHandler:
 		self.pitch = 0;
 		self.yaw = 0;
 
-		self.rollBuffer = []
+		# set while a GyroscopeSampler keeps failing, the readings are stale
+		self.sensorFailed = False
+
 		self.pitchBuffer = []
 		self.yawBuffer = []
 
 		self.greatestVal = 0
 		self.maxLeanTimeout = 5000
 
+		# only the samples that can still be the greatest roll are buffered
+		self.rollBuffer = SlidingWindowMax.SlidingWindowMax(self.maxLeanTimeout)
+
+		# Per-side lean statistics over several horizons, allTime is kept in
+		# statisticsPath across runs
+		if leanHorizons is None:
+			leanHorizons = [("window", self.maxLeanTimeout), ("lap", None), ("session", None), ("allTime", None)]
+		self.leanStatistics = LeanStatistics.LeanStatistics(leanHorizons)
+		self.allTimeHorizons = [name for name, window in leanHorizons if name == "allTime"]
+		self.statisticsPath = statisticsPath
+		if statisticsPath is not None:
+			self.leanStatistics.load(statisticsPath)
+
 		self.rollChangeThresholdWarning = False
 
 		self.deltaThreshold = deltaThreshold
 		self.selfCorrectingThreshold = selfCorrectingThreshold
 
+		# Readings further than deltaThreshold from the median of the last
+		# outlierWindow ones are refused, unless within selfCorrectingThreshold of level
+		self.outlierFilter = OutlierFilter.OutlierFilter(deltaThreshold, outlierWindow, selfCorrectingThreshold)
+
 
 	def update(self):
 		self.gyroscopeHardware.update()
+		self.sensorFailed = getattr(self.gyroscopeHardware, "failed", False)
 		self.grabGyroVals()
 
 		if self.switch.switchState:
@@ -40,34 +78,51 @@ class GyroscopeHandler:
 			self.setCurrentStateAsOffsets()
 
 		# Store the highest roll value from the last X seconds
-		rollDataObj = GyroAxisData.GyroAxisData("roll", abs(self.roll), int(round(time.time() * 1000)))
-		self.rollBuffer.append(rollDataObj)
+		now = int(round(self.clock() * 1000))
+		rollDataObj = GyroAxisData.GyroAxisData("roll", abs(self.roll), now)
+		# maxLeanTimeout can be changed at any time
+		self.rollBuffer.window = self.maxLeanTimeout
+		self.rollBuffer.add(rollDataObj, now)
+
+		self.greatestVal = self.rollBuffer.getMax()
 
-		while True:
-			if int(round(time.time() * 1000)) - self.rollBuffer[0].time > self.maxLeanTimeout:
-				self.rollBuffer.pop(0)
-			else:
-				break
+		self.updateLeanStatistics(now)
 
-		self.greatestVal = max(self.rollBuffer, key=attrgetter("val")).val
+	def updateLeanStatistics(self, now):
+		# Every sample the sampler read since the last frame, or the frame's roll
+		if hasattr(self.gyroscopeHardware, "getSamples"):
+			for sample in self.gyroscopeHardware.getSamples():
+				self.leanStatistics.add(int(round(sample[0] * 1000)), sample[3])
+		else:
+			self.leanStatistics.add(now, self.roll)
+
+	def newLap(self):
+		self.leanStatistics.reset("lap")
+
+	def saveStatistics(self):
+		if self.statisticsPath is not None:
+			self.leanStatistics.save(self.statisticsPath, self.allTimeHorizons)
 
 	def setCurrentStateAsOffsets(self):
 		self.setGyroOffsets(self.roll, self.pitch, self.yaw)
 
-	def validateNewValue(self, errorStr, gyroAttribStr, thisAttribStr, deltaThreshold, selfCorrectingThreshold):
-		gyroAttribVal = getattr(self.gyroscopeHardware, gyroAttribStr)
-		thisAttribVal = getattr(self, thisAttribStr)
+		# Take the current pose as the next one of the mounting calibration:
+		# upright levels pitch and roll, the side stand after it adds the yaw
+		hardware = self.gyroscopeHardware
+		if not hasattr(hardware, "setMountingQuaternion"):
+			return
 
-		if abs(gyroAttribVal - thisAttribVal) < deltaThreshold:
-			setattr(self, thisAttribStr, int(gyroAttribVal))
-		elif abs(gyroAttribVal) < selfCorrectingThreshold:
-			setattr(self, thisAttribStr, int(gyroAttribVal))
-		else:
-			print errorStr + "\t" + str(abs(gyroAttribVal - thisAttribVal))
-			return False
+		# gravity back on the sensor's axes, undoing the mounting applied now
+		mounting = hardware.getMountingQuaternion() or Calibration.IDENTITY
+		gravity = Calibration.rotate(mounting, Calibration.gravityFromPitchRoll(hardware.pitch, hardware.roll))
 
-		# Default case
-		return True
+		mounting = self.mountingCalibration.addPose(gravity, self.clock())
+		hardware.setMountingQuaternion(mounting)
+
+		if self.calibrationPath is not None:
+			Calibration.save(self.calibrationPath, mounting)
+
+		print self.mountingCalibration.getPrompt()
 
 	def setGyroOffsets(self, roll, pitch, yaw):
 		self.rollOffset = roll
@@ -78,10 +133,11 @@ class GyroscopeHandler:
 		print 'Roll: {} Pitch: {} Yaw: {}'.format(self.rollOffset, self.pitchOffset, self.yawOffset)
 
 	def grabGyroVals(self):
-		if not self.validateNewValue("REFUSING ROLL", "roll", "roll", self.deltaThreshold, self.selfCorrectingThreshold):
-			self.rollChangeThresholdWarning = True
-		else:
-			self.rollChangeThresholdWarning = False
+		hardware = self.gyroscopeHardware
+		roll, pitch, yaw = self.outlierFilter.update(hardware.roll, hardware.pitch, hardware.yaw)
+
+		self.roll = int(roll)
+		self.pitch = int(pitch)
+		self.yaw = int(yaw)
 
-		self.validateNewValue("REFUSING PITCH", "pitch", "pitch", self.deltaThreshold, self.selfCorrectingThreshold)
-		self.validateNewValue("REFUSING YAW", "yaw", "yaw", self.deltaThreshold, self.selfCorrectingThreshold)
+		self.rollChangeThresholdWarning = self.outlierFilter.lastRejected[0]
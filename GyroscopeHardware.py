@@ -1,27 +1,169 @@
 import time
 import math
+import threading
 import mpu6050
+import SensorFusion
+import SensorProfile
+import GyroBiasCalibration
 import GyroAxisData
 
 class GyroscopeHardware:
 
-	def __init__(self):
+	def __init__(self, warmStart = True, bus = None, intPin = None, gpio = None, drainFIFO = False, engine = "dmp", fusion = None, rawRate = 0, profile = None, mounting = None, biasCalibration = True, rawBusNumber = None):
 
-		# Sensor initialization
-		self.mpu = mpu6050.MPU6050()
-		self.mpu.dmpInitialize()
-		self.mpu.setDMPEnabled(True)
+		# bus defaults to the Pi's I2C bus, see SimulatedMPU6050 for an
+		# alternative. rawBusNumber is the N of its /dev/i2c-N, for FIFO reads
+		# in one transfer.
+		self.mpu = mpu6050.MPU6050(bus = bus, rawBusNumber = rawBusNumber)
+		self.mpu.enableRegisterShadow()
 
-		# get expected DMP packet size for later comparison
-		self.packetSize = self.mpu.dmpGetFIFOPacketSize()
+		# mounting calibration quaternion, see Calibration
+		self.mpu.setMountingQuaternion(mounting)
+
+		# "dmp" fuses on the chip, "raw" reads the sensors at 1kHz / (1 + rawRate)
+		# and fuses them here with fusion (see SensorFusion), no firmware upload
+		self.engine = engine
+		if engine == "raw":
+			self.setupRaw(fusion, rawRate)
+		else:
+			self.setupDMP(warmStart)
+
+		# a SensorProfile or the name of one, None keeps the rates set up above
+		self.profile = None
+		if profile is not None:
+			self.setProfile(profile)
+
+		# trims the gyro offset registers whenever the bike stands still, see
+		# GyroBiasCalibration, None when turned off
+		self.biasCalibration = None
+		if biasCalibration:
+			self.biasCalibration = GyroBiasCalibration.GyroBiasCalibration(self.mpu, roll = lambda: self.roll)
 
 		self.yaw = 0
 		self.pitch = 0
 		self.roll = 0
 
+		# roll rate in deg/s and sideways acceleration in g, without gravity
+		self.rollRate = 0
+		self.lateralAccel = 0
+
+		# (yaw, pitch, roll, rollRate, lateralAccel) of every packet read by
+		# the last update, oldest first
+		self.samples = []
+
+		# raw DMP packets behind self.samples, packetSize bytes each, None
+		# with the raw engine
+		self.packetData = None
+
+		# refilled by every packet decode
+		self.sample = mpu6050.DMPSample()
+
+		# Read every queued packet and keep the FIFO running, instead of reading
+		# one packet and resetting the FIFO
+		self.drainFIFO = drainFIFO
+
+		# below this many packets the numpy setup costs more than decoding
+		# them one by one
+		self.batchDecodeThreshold = 16
+
+		# With the MPU6050 INT pin wired to intPin (BCM numbering) we wait for
+		# its edge instead of polling INT_STATUS over the bus
+		self.intPin = None
+		self.dataReady = threading.Event()
+		if intPin is not None:
+			self.setupInterrupt(intPin, gpio)
+
+	def setupDMP(self, warmStart):
+		# Sensor initialization, a restarted process can reuse the DMP program
+		# that is still loaded on the chip instead of uploading it again.
+		if not (warmStart and self.mpu.dmpWarmStart()):
+			self.mpu.dmpInitialize()
+		self.mpu.setDMPEnabled(True)
+
+		# get expected DMP packet size for later comparison
+		self.packetSize = self.mpu.dmpGetFIFOPacketSize()
+		self.packetInterval = 1.0 / self.mpu.dmpGetFIFORate()
+
+	def setupRaw(self, fusion, rawRate):
+		self.mpu.rawInitialize(rawRate)
+		self.packetInterval = (1 + rawRate) / 1000.0
+
+		if fusion is None:
+			fusion = SensorFusion.MadgwickFilter()
+		self.fusion = fusion
+		self.lastRawTime = None
+
+	def setProfile(self, profile):
+		# Switches sample rate, DLPF and DMP FIFO rate without a re-init.
+		# Not thread safe, see GyroscopeSampler.setProfile.
+		if isinstance(profile, str):
+			profile = SensorProfile.profiles[profile]
+
+		self.mpu.setDLPFMode(profile.dlpfMode)
+
+		# the DMP keeps its own sample rate, only its output rate changes
+		if self.engine == "raw":
+			self.mpu.setRate(profile.rate)
+			self.packetInterval = 1.0 / profile.getSampleRate()
+		else:
+			self.mpu.dmpSetFIFORateDivider(profile.fifoRateDivider)
+			self.packetInterval = 1.0 / profile.getDMPRate()
+
+			# queued packets are from the old rate
+			self.mpu.resetFIFO()
+
+		self.profile = profile
+
+	def setMountingQuaternion(self, q):
+		self.mpu.setMountingQuaternion(q)
+
+	def getMountingQuaternion(self):
+		return self.mpu.getMountingQuaternion()
+
+	def setupInterrupt(self, intPin, gpio):
+		if gpio is None:
+			try:
+				import RPi.GPIO as gpio
+			except ImportError:
+				print "GPIO unavailable, polling the gyroscope instead"
+				return
+
+		gpio.setmode(gpio.BCM)
+		gpio.setup(intPin, gpio.IN, pull_up_down = gpio.PUD_DOWN)
+		gpio.add_event_detect(intPin, gpio.RISING, callback = self.onDataReady)
+		self.intPin = intPin
+
+	def onDataReady(self, channel):
+		# GPIO callback thread
+		self.dataReady.set()
+
+	def waitForData(self, timeout):
+		# Blocks until the INT pin signals a packet, returns False on timeout.
+		# Without an INT pin there is nothing to wait for, update() polls.
+		if self.intPin is None:
+			return True
+
+		return self.dataReady.wait(timeout)
+
 	def update(self):
-	    # Get INT_STATUS byte
-	    mpuIntStatus = self.mpu.getIntStatus()
+	    # Returns True when a new sample was read
+
+	    if self.biasCalibration is not None:
+	        self.biasCalibration.update()
+
+	    if self.engine == "raw":
+	        return self.updateRaw()
+
+	    if self.drainFIFO:
+	        return self.updateAll()
+
+	    if self.dataReady.is_set():
+	        # the INT pin edge already told us the DMP has data
+	        self.dataReady.clear()
+	        mpuIntStatus = 1 << self.mpu.MPU6050_INTERRUPT_DMP_INT_BIT
+	    else:
+	        # Get INT_STATUS byte
+	        mpuIntStatus = self.mpu.getIntStatus()
 	  
 	  	# check for DMP data ready interrupt (this should happen frequently) 
 	    if mpuIntStatus >= 2: 
@@ -38,16 +180,21 @@ class GyroscopeHardware:
 	        # wait for correct available data length, should be a VERY short wait
 	        self.fifoCount = self.mpu.getFIFOCount()
 	        while self.fifoCount < self.packetSize:
+	            # the edge was for a packet that has been reset away, wait for the next one
+	            if self.intPin is not None:
+	                return False
 	            self.fifoCount = self.mpu.getFIFOCount()
 	        
 	        result = self.mpu.getFIFOBytes(self.packetSize)
-	        q = self.mpu.dmpGetQuaternion(result)
-	        g = self.mpu.dmpGetGravity(q)
-	        ypr = self.mpu.dmpGetYawPitchRoll(q, g)
+	        if result == -1:
+	            # part of the packet may have been read, start again on a packet boundary
+	            self.mpu.resetFIFO()
+	            return False
 
-	        self.yaw = ypr['yaw'] * 180 / math.pi
-	        self.pitch = ypr['pitch'] * 180 / math.pi
-	        self.roll = ypr['roll'] * 180 / math.pi
+	        result = bytearray(result)
+	        self.packetData = result
+	        self.samples = [self.decodePacket(result)]
+	        self.yaw, self.pitch, self.roll, self.rollRate, self.lateralAccel = self.samples[0]
 	    
 	        # track FIFO count here in case there is > 1 packet available
 	        # (this lets us immediately read more without waiting for an interrupt)        
@@ -56,6 +203,94 @@ class GyroscopeHardware:
 			# CRAIG
 	        # Clear the FIFO buffer else it'll overflow!
 	        self.mpu.resetFIFO()
+	        return True
+
+	    return False
+
+	def updateAll(self):
+		# Reads every complete packet in the FIFO with one bulk transfer.
+		# The FIFO count is all we need, so INT_STATUS is not read.
+		self.dataReady.clear()
+
+		fifoCount = self.mpu.getFIFOCount()
+
+		# check for overflow, the FIFO no longer starts on a packet boundary
+		if fifoCount == 1024:
+			self.mpu.resetFIFO()
+			print('FIFO overflow!')
+			return False
+
+		packetCount = fifoCount // self.packetSize
+		if packetCount == 0:
+			return False
+
+		data = self.mpu.getFIFOBytes(packetCount * self.packetSize)
+		if data == -1:
+			# part of it may have been read, start again on a packet boundary
+			self.mpu.resetFIFO()
+			return False
+
+		data = bytearray(data)
+		self.packetData = data
+
+		if mpu6050.numpy is not None and packetCount >= self.batchDecodeThreshold:
+			self.samples = self.decodePackets(data)
+		else:
+			self.samples = [self.decodePacket(data, i) for i in range(0, len(data), self.packetSize)]
+		self.yaw, self.pitch, self.roll, self.rollRate, self.lateralAccel = self.samples[-1]
+		return True
+
+	def updateRaw(self):
+		# One burst read of the sensors, fused on the host
+		if self.dataReady.is_set():
+			self.dataReady.clear()
+		elif not self.mpu.getIntDataReadyStatus():
+			return False
+
+		motion = self.mpu.getMotion6Scaled()
+		if motion == -1:
+			return False
+
+		# integrate over the time since the last read, but not over long stalls
+		now = time.time()
+		if self.lastRawTime is None:
+			dt = self.packetInterval
+		else:
+			dt = min(now - self.lastRawTime, 0.1)
+		self.lastRawTime = now
+
+		ax, ay, az, gx, gy, gz = motion
+
+		# turn the readings to the bike's axes before fusing them
+		mounting = self.mpu.mounting
+		if mounting is not None:
+			(m00, m01, m02), (m10, m11, m12), (m20, m21, m22) = mounting[1]
+			ax, ay, az = m00 * ax + m01 * ay + m02 * az, m10 * ax + m11 * ay + m12 * az, m20 * ax + m21 * ay + m22 * az
+			gx, gy, gz = m00 * gx + m01 * gy + m02 * gz, m10 * gx + m11 * gy + m12 * gz, m20 * gx + m21 * gy + m22 * gz
+
+		self.fusion.update((gx, gy, gz), (ax, ay, az), dt)
+
+		gravityY = self.fusion.getGravity()[1]
+		self.samples = [(math.degrees(self.fusion.yaw), math.degrees(self.fusion.pitch), math.degrees(self.fusion.roll), gx, ay - gravityY)]
+		self.yaw, self.pitch, self.roll, self.rollRate, self.lateralAccel = self.samples[0]
+		return True
+
+	def decodePackets(self, data):
+		# Vectorized decodePacket over a buffer of whole packets
+		q = self.mpu.dmpGetQuaternionBatch(data)
+		g = self.mpu.dmpGetGravityBatch(q)
+		ypr = self.mpu.dmpGetYawPitchRollBatch(q, g)
+		gyro = self.mpu.dmpGetGyroBatch(data)
+		linearAccel = self.mpu.dmpGetLinearAccelBatch(self.mpu.dmpGetAccelBatch(data), g)
+
+		samples = mpu6050.numpy.column_stack((ypr * (180 / math.pi), gyro[:, 0], linearAccel[:, 1]))
+		return [tuple(sample) for sample in samples.tolist()]
+
+	def decodePacket(self, packet, offset = 0):
+		# Returns (yaw, pitch, roll, rollRate, lateralAccel), angles in degrees
+		sample = self.mpu.dmpDecodePacket(packet, self.sample, offset)
+
+		return (math.degrees(sample.yaw), math.degrees(sample.pitch), math.degrees(sample.roll), sample.gyroX, sample.linearAccelY)
 
 	def display(self):
 		print "Yaw: " + str(self.yaw) + "\t Pitch: " + str(self.pitch) + "\t Roll: " + str(self.roll)
@@ -0,0 +1,145 @@
+import time
+import threading
+
+import SampleRingBuffer
+
+class GyroscopeSampler:
+	"""Reads the gyroscope hardware on its own thread so sampling keeps to the
+	DMP rate however long a frame takes to draw. Exposes the same yaw, pitch,
+	roll, rollRate and lateralAccel attributes as GyroscopeHardware, updated
+	from the latest sample."""
+
+	def __init__(self, gyroscopeHardware, bufferSize = 1000, idleSleep = 0.001, interruptTimeout = 0.1, recorder = None, maxErrors = 10):
+		self.gyroscopeHardware = gyroscopeHardware
+
+		# every sample is also handed to the recorder (see SessionRecorder)
+		self.recorder = recorder
+
+		# (time, yaw, pitch, roll, rollRate, lateralAccel) of the last
+		# bufferSize samples, getSamples() hands out the ones from readSeq on
+		self.samples = SampleRingBuffer.SampleRingBuffer(bufferSize)
+		self.readSeq = 0
+		self.latest = (0, 0, 0, 0, 0, 0)
+		self.lock = threading.RLock()
+
+		# how long to wait before polling again when no packet was ready, and
+		# how long to wait for the INT pin before checking the chip anyway
+		self.idleSleep = idleSleep
+		self.interruptTimeout = interruptTimeout
+
+		self.yaw = 0
+		self.pitch = 0
+		self.roll = 0
+		self.rollRate = 0
+		self.lateralAccel = 0
+		self.sampleTime = 0
+
+		self.running = False
+		self.thread = None
+
+		# applied by the sampling thread so it never races an update
+		self.pendingProfile = None
+
+		# errors in a row, failed is set after maxErrors of them and cleared
+		# by the next good sample so the display can show the data is stale
+		self.maxErrors = maxErrors
+		self.errors = 0
+		self.failed = False
+
+	def start(self):
+		self.running = True
+		self.thread = threading.Thread(target = self.run)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def stop(self):
+		self.running = False
+		if self.thread is not None:
+			self.thread.join()
+			self.thread = None
+
+	def run(self):
+		while self.running:
+			try:
+				if not self.sample():
+					time.sleep(self.idleSleep)
+					continue
+			except Exception as e:
+				# keep sampling whatever went wrong, a bus glitch or a full card
+				self.errors += 1
+				if self.errors < self.maxErrors:
+					print("Gyroscope sampling error: %r" % e)
+				elif not self.failed:
+					print("Gyroscope sampling failing, %d errors in a row: %r" % (self.errors, e))
+					self.failed = True
+				time.sleep(self.idleSleep)
+				continue
+
+			self.errors = 0
+			self.failed = False
+
+	def sample(self):
+		# Reads and hands out the next samples, returns False when there were none
+		hardware = self.gyroscopeHardware
+
+		if self.pendingProfile is not None:
+			profile, self.pendingProfile = self.pendingProfile, None
+			hardware.setProfile(profile)
+
+		hardware.waitForData(self.interruptTimeout)
+
+		if not hardware.update():
+			return False
+
+		# a drained FIFO holds several packets, the last one is the newest
+		now = time.time()
+		count = len(hardware.samples)
+		samples = [(now - (count - 1 - i) * hardware.packetInterval,) + sample for i, sample in enumerate(hardware.samples)]
+
+		with self.lock:
+			self.samples.extend(samples)
+			self.latest = samples[-1]
+
+		if self.recorder is not None:
+			self.recorder.record(samples, hardware.packetData)
+
+		return True
+
+	def setProfile(self, profile):
+		# Switches the hardware's SensorProfile at the next sample
+		if self.thread is None:
+			self.gyroscopeHardware.setProfile(profile)
+		else:
+			self.pendingProfile = profile
+
+	def setMountingQuaternion(self, q):
+		# Takes effect from the next packet decoded
+		self.gyroscopeHardware.setMountingQuaternion(q)
+
+	def getMountingQuaternion(self):
+		return self.gyroscopeHardware.getMountingQuaternion()
+
+	def update(self):
+		# Called from the render loop, only picks up the latest sample
+		with self.lock:
+			sample = self.latest
+
+		self.sampleTime, self.yaw, self.pitch, self.roll, self.rollRate, self.lateralAccel = sample
+
+	def getSamples(self):
+		# Returns every sample read since the last call, oldest first
+		with self.lock:
+			samples = self.samples.getSamples(self.readSeq)
+			self.readSeq = self.samples.nextSeq
+
+		return samples
+
+	def getHistory(self, field, seconds):
+		# Zero-copy numpy views of one field over the last seconds, see
+		# SampleRingBuffer.getViews. Hold self.lock while reading them.
+		with self.lock:
+			startSeq = self.samples.nextSeq - int(seconds / self.gyroscopeHardware.packetInterval)
+			return self.samples.getViews(field, startSeq)
+
+	def display(self):
+		print "Yaw: " + str(self.yaw) + "\t Pitch: " + str(self.pitch) + "\t Roll: " + str(self.roll)
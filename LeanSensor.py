@@ -10,6 +10,11 @@ import time
 
 import GyroscopeHandler
 import GyroscopeHardware
+import GyroscopeSampler
+import SensorProfile
+import SessionRecorder
+import ReplaySource
+import Calibration
 import GyroAxisData
 import TextLabel
 import Utility
@@ -24,6 +29,37 @@ if not pygame.mixer: print 'Warning, sound disabled'
 
 roll = 0
 
+# BCM pin wired to the MPU6050 INT pin, None polls the sensor over I2C instead
+gyroIntPin = None
+
+# /dev/i2c-N the sensor is on, opened to read the FIFO in one transfer, None
+# keeps to 32 byte SMBus block reads
+gyroRawBusNumber = 1
+
+# sample rate profile, see SensorProfile.profiles
+gyroProfile = SensorProfile.defaultProfile
+
+# roll, pitch and yaw readings further than gyroDeltaThreshold degrees from the
+# median of the last gyroOutlierWindow are refused, unless within
+# gyroSelfCorrectingThreshold of level
+gyroDeltaThreshold = 15
+gyroSelfCorrectingThreshold = 10
+gyroOutlierWindow = 5
+
+# file keeping the mounting calibration taken with the switch
+calibrationPath = "calibration.json"
+
+# file keeping the all-time lean statistics between runs, None to not keep them
+leanStatisticsPath = None
+
+# directory every ride is recorded to at full rate, None to not record
+recordingDirectory = None
+
+# recorded session files to play back instead of reading the sensor, at
+# replaySpeed times real time
+replayPaths = None
+replaySpeed = 1.0
+
 class PyManMain:
     """The Main PyMan Class - This class handles the main 
     initialization and creating of the Game."""
@@ -58,7 +94,23 @@ class PyManMain:
         self.background.fill((205, 50, 50))
         
     def setupGyroscope(self):
-        self.gyroscopeHandler = GyroscopeHandler.GyroscopeHandler(self.switch, 15, 10)
+        self.recorder = None
+
+        if replayPaths is not None:
+            gyroscopeSource = ReplaySource.ReplaySource(replayPaths, replaySpeed)
+            clock = gyroscopeSource.getTime
+        else:
+            if recordingDirectory is not None:
+                self.recorder = SessionRecorder.SessionRecorder(recordingDirectory)
+
+            gyroscopeHardware = GyroscopeHardware.GyroscopeHardware(intPin = gyroIntPin, drainFIFO = True, profile = gyroProfile,
+                mounting = Calibration.load(calibrationPath), rawBusNumber = gyroRawBusNumber)
+            gyroscopeSource = GyroscopeSampler.GyroscopeSampler(gyroscopeHardware, recorder = self.recorder)
+            gyroscopeSource.start()
+            clock = time.time
+
+        self.gyroscopeHandler = GyroscopeHandler.GyroscopeHandler(self.switch, gyroDeltaThreshold, gyroSelfCorrectingThreshold, gyroscopeSource,
+            statisticsPath = leanStatisticsPath, outlierWindow = gyroOutlierWindow, clock = clock, calibrationPath = calibrationPath)
         self.addToUpdateList(self.gyroscopeHandler)
 
     def setupLeanMeterDisplay(self):
@@ -94,14 +146,22 @@ class PyManMain:
 
         pygame.display.update()
 
+    def shutdown(self):
+        # Keep the all-time statistics and finish the recording before exiting
+        self.gyroscopeHandler.saveStatistics()
+        if self.recorder is not None:
+            self.recorder.close()
+
     def MainLoop(self):        
         while 1:
 
             for event in pygame.event.get():
                 if event.type == pygame.QUIT: 
+                    self.shutdown()
                     sys.exit()
 
                 if event.type == KEYDOWN:
+                    self.shutdown()
                     pygame.quit()
                     return
 
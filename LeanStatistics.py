@@ -0,0 +1,181 @@
+import json
+from collections import deque
+
+LEFT = 0
+RIGHT = 1
+
+class LeanHorizon:
+	"""Peak, mean and histogram of the lean to each side over one horizon,
+	either the last window milliseconds or everything since the last reset
+	(window None)."""
+
+	def __init__(self, name, window, bins):
+		self.name = name
+		self.window = window
+
+		# sequence number of the oldest sample still inside the window
+		self.start = 0
+
+		self.peak = [0, 0]
+		self.total = [0.0, 0.0]
+		self.count = [0, 0]
+		self.histogram = [[0] * bins, [0] * bins]
+
+		# (sequence number, lean) per side that can still become the peak,
+		# leans decreasing from the front, only used with a window
+		self.peakQueue = [deque(), deque()]
+
+	def add(self, seq, side, lean, bin):
+		self.total[side] += lean
+		self.count[side] += 1
+		self.histogram[side][bin] += 1
+
+		if self.window is None:
+			self.peak[side] = max(self.peak[side], lean)
+			return
+
+		queue = self.peakQueue[side]
+		while queue and queue[-1][1] <= lean:
+			queue.pop()
+		queue.append((seq, lean))
+
+	def expire(self, now, statistics):
+		# Drops the samples that have left the window
+		if self.window is None:
+			return
+
+		samples = statistics.samples
+		while self.start < statistics.nextSeq:
+			time, side, lean, bin = samples[self.start - statistics.firstSeq]
+			if now - time <= self.window:
+				break
+
+			self.total[side] -= lean
+			self.count[side] -= 1
+			self.histogram[side][bin] -= 1
+
+			queue = self.peakQueue[side]
+			if queue and queue[0][0] == self.start:
+				queue.popleft()
+
+			self.start += 1
+
+		for side in (LEFT, RIGHT):
+			queue = self.peakQueue[side]
+			self.peak[side] = queue[0][1] if queue else 0
+
+	def reset(self, nextSeq):
+		self.start = nextSeq
+		for side in (LEFT, RIGHT):
+			self.peak[side] = 0
+			self.total[side] = 0.0
+			self.count[side] = 0
+			self.histogram[side] = [0] * len(self.histogram[side])
+			self.peakQueue[side].clear()
+
+class LeanStatistics:
+	"""Per-side lean peak, mean and percentiles over several horizons at once,
+	for example the last 5 seconds, this lap, this session and all time.
+
+	Every sample costs O(1) per horizon. The windowed horizons share one
+	buffer of samples and each walk it from their own start, percentiles come
+	from fixed-bin histograms."""
+
+	def __init__(self, horizons, binSize = 1.0, maxLean = 90.0):
+		# horizons is a list of (name, window in ms or None for no time limit)
+		self.binSize = binSize
+		self.bins = int(maxLean / binSize) + 1
+
+		self.horizons = [LeanHorizon(name, window, self.bins) for name, window in horizons]
+		self.horizonsByName = dict((horizon.name, horizon) for horizon in self.horizons)
+
+		# (time, side, lean, bin) of samples that some window still covers,
+		# samples[0] has sequence number firstSeq
+		self.samples = []
+		self.firstSeq = 0
+		self.nextSeq = 0
+
+	def add(self, time, roll):
+		# time in ms, negative roll leans left
+		side = LEFT if roll < 0 else RIGHT
+		lean = abs(roll)
+		bin = min(int(lean / self.binSize), self.bins - 1)
+
+		seq = self.nextSeq
+		self.nextSeq += 1
+		self.samples.append((time, side, lean, bin))
+
+		oldest = self.nextSeq
+		for horizon in self.horizons:
+			horizon.add(seq, side, lean, bin)
+			horizon.expire(time, self)
+			if horizon.window is not None:
+				oldest = min(oldest, horizon.start)
+
+		self.discard(oldest)
+
+	def discard(self, oldest):
+		# Forgets samples before oldest, in batches so it stays amortized O(1)
+		count = oldest - self.firstSeq
+		if count > 0 and count * 2 >= len(self.samples):
+			del self.samples[:count]
+			self.firstSeq = oldest
+
+	def reset(self, name):
+		# Starts a horizon over, for a new lap
+		self.horizonsByName[name].reset(self.nextSeq)
+
+	def getPeak(self, name, side):
+		return self.horizonsByName[name].peak[side]
+
+	def getMean(self, name, side):
+		horizon = self.horizonsByName[name]
+		if horizon.count[side] == 0:
+			return 0
+		return horizon.total[side] / horizon.count[side]
+
+	def getPercentile(self, name, side, percentile):
+		# Lean that percentile percent of the samples stay at or below, to
+		# the nearest bin above
+		horizon = self.horizonsByName[name]
+		rank = horizon.count[side] * percentile / 100.0
+		if rank <= 0:
+			return 0
+
+		seen = 0
+		for bin, count in enumerate(horizon.histogram[side]):
+			seen += count
+			if seen >= rank:
+				return (bin + 1) * self.binSize
+
+		return self.bins * self.binSize
+
+	def save(self, path, names):
+		# Writes the horizons without a time limit, so all-time stats survive a restart
+		state = {}
+		for name in names:
+			horizon = self.horizonsByName[name]
+			state[name] = {"peak" : horizon.peak, "total" : horizon.total, "count" : horizon.count, "histogram" : horizon.histogram}
+
+		with open(path, "w") as f:
+			json.dump(state, f)
+
+	def load(self, path):
+		try:
+			with open(path) as f:
+				state = json.load(f)
+		except (IOError, ValueError):
+			print "No lean statistics loaded from " + path
+			return False
+
+		for name, values in state.items():
+			horizon = self.horizonsByName.get(name)
+			if horizon is None or horizon.window is not None or len(values["histogram"][0]) != self.bins:
+				continue
+
+			horizon.peak = values["peak"]
+			horizon.total = values["total"]
+			horizon.count = values["count"]
+			horizon.histogram = values["histogram"]
+
+		return True
@@ -0,0 +1,47 @@
+from collections import deque
+
+class OutlierFilter:
+	"""Hampel style filter for (roll, pitch, yaw) readings.
+
+	A reading is rejected when it is further than threshold from the median
+	of the last window raw readings of its axis, and the last accepted value
+	is kept instead. A real fast transition moves the median along with it,
+	so it is accepted after about half a window instead of latching onto a
+	stale value. Constant time per sample."""
+
+	AXES = ("roll", "pitch", "yaw")
+
+	def __init__(self, threshold, window = 5, zeroThreshold = 0):
+		self.threshold = threshold
+		self.window = window
+
+		# readings this close to level are always accepted
+		self.zeroThreshold = zeroThreshold
+
+		self.history = [deque(maxlen = window) for axis in self.AXES]
+		self.values = [0, 0, 0]
+
+		# rejections per axis since the start, and whether the last reading was one
+		self.rejected = [0, 0, 0]
+		self.lastRejected = [False, False, False]
+
+	def update(self, roll, pitch, yaw):
+		# Returns the filtered (roll, pitch, yaw)
+		for axis, value in enumerate((roll, pitch, yaw)):
+			history = self.history[axis]
+			history.append(value)
+
+			ordered = sorted(history)
+			median = ordered[len(ordered) // 2]
+
+			if abs(value - median) <= self.threshold or abs(value) < self.zeroThreshold:
+				self.values[axis] = value
+				self.lastRejected[axis] = False
+			else:
+				self.rejected[axis] += 1
+				self.lastRejected[axis] = True
+
+		return tuple(self.values)
+
+	def getRejectedCounts(self):
+		return dict(zip(self.AXES, self.rejected))
@@ -0,0 +1,272 @@
+import sys
+import time
+from bisect import bisect_right
+
+import SessionRecorder
+import SessionIndex
+import CompactSession
+
+class ReplayRecords:
+	"""The (time, yaw, pitch, roll, rollRate, lateralAccel) records of a set of
+	session files as one sequence, read from the files only as they are
+	needed (see SessionRecorder.SessionFile)"""
+
+	def __init__(self, files):
+		self.files = files
+
+		# number of the first record of every file
+		self.starts = []
+		self.count = 0
+		for sessionFile in self.files:
+			self.starts.append(self.count)
+			self.count += len(sessionFile)
+
+	def __len__(self):
+		return self.count
+
+	def locate(self, i):
+		# The file holding record i and the record's number within it
+		number = bisect_right(self.starts, i) - 1
+		return self.files[number], i - self.starts[number]
+
+	def __getitem__(self, i):
+		if isinstance(i, slice):
+			return [self[j] for j in range(*i.indices(self.count))]
+
+		if i < 0:
+			i += self.count
+		if not 0 <= i < self.count:
+			raise IndexError(i)
+
+		sessionFile, pos = self.locate(i)
+		record = sessionFile[pos]
+		return (record[0],) + record[2:]
+
+	def getTime(self, i):
+		sessionFile, pos = self.locate(i)
+		return sessionFile.getTime(pos)
+
+class ReplaySource:
+	"""Plays recorded sessions (see SessionRecorder) back in place of
+	GyroscopeHardware or GyroscopeSampler, so GyroscopeHandler and the
+	displays can be run and tested without riding the bike.
+
+	speed 1 plays back in real time, 10 ten times faster, None as fast as
+	possible with one sample per update(). Times always come from the
+	recording, pass getTime as the handler's clock.
+
+	Records are read as they are played, seek() finds its record with the
+	sidecar index (see SessionIndex) and a binary search, so long sessions
+	start and seek without reading them through."""
+
+	def __init__(self, paths, speed = 1.0, loop = False):
+		files = []
+
+		# index of every file, None for those without one
+		self.indexes = []
+
+		for path in paths:
+			# compact files (see CompactSession) share the index of the original
+			if path.endswith(".lrz"):
+				sessionFile = CompactSession.CompactSessionFile(path)
+				indexPath = path[:-len(".lrz")]
+			else:
+				sessionFile = SessionRecorder.SessionFile(path)
+				indexPath = path
+
+			# empty files have nothing to play
+			if len(sessionFile) == 0:
+				sessionFile.close()
+				continue
+
+			files.append(sessionFile)
+			self.indexes.append(SessionIndex.loadIndex(indexPath))
+
+		# corners of all files, see getCorners
+		self.corners = None
+
+		self.records = ReplayRecords(files)
+		self.speed = speed
+		self.loop = loop
+
+		self.pos = 0
+		self.readPos = 0
+
+		# samples of the previous loop not yet taken by getSamples()
+		self.pending = []
+		self.finished = not self.records
+		self.startTime = None
+
+		# shift added to the recorded times, grows with every loop so time
+		# never goes backwards
+		self.timeOffset = 0
+
+		self.yaw = 0
+		self.pitch = 0
+		self.roll = 0
+		self.rollRate = 0
+		self.lateralAccel = 0
+		self.sampleTime = self.records.getTime(0) if self.records else 0
+
+		self.packetInterval = 0
+		if len(self.records) > 1:
+			self.packetInterval = (self.records.getTime(len(self.records) - 1) - self.records.getTime(0)) / (len(self.records) - 1)
+
+	def getTime(self):
+		# Recorded time of the current sample, in seconds
+		return self.sampleTime
+
+	def update(self):
+		# Moves on to the samples due by now, returns True when there were any
+		if self.finished:
+			return False
+
+		if self.speed is None:
+			end = self.pos + 1
+		else:
+			now = time.time()
+			if self.startTime is None:
+				self.startTime = now
+				self.startRecordTime = self.records.getTime(self.pos)
+			replayTime = self.startRecordTime + (now - self.startTime) * self.speed - self.timeOffset
+
+			end = self.pos
+			while end < len(self.records) and self.records.getTime(end) <= replayTime:
+				end += 1
+
+		if end == self.pos:
+			return False
+
+		self.pos = end
+		sampleTime, self.yaw, self.pitch, self.roll, self.rollRate, self.lateralAccel = self.records[end - 1]
+		self.sampleTime = sampleTime + self.timeOffset
+
+		if self.pos == len(self.records):
+			self.rewind()
+
+		return True
+
+	def seek(self, time):
+		# Carries on from the first sample at or after the recorded time
+		self.seekRecord(self.findTime(time))
+
+	def findTime(self, time):
+		# Number of the first record at or after the recorded time. The file's
+		# index narrows the binary search down to one index interval.
+		records = self.records
+		for sessionFile, start, index in zip(records.files, records.starts, self.indexes):
+			count = len(sessionFile)
+			if sessionFile.getTime(count - 1) < time:
+				continue
+
+			low, high = 0, count
+			if index is not None:
+				low = min(index.findRecord(time), count)
+				after = index.findRecordAfter(time)
+				if after is not None:
+					high = min(after, count)
+
+			while low < high:
+				middle = (low + high) // 2
+				if sessionFile.getTime(middle) < time:
+					low = middle + 1
+				else:
+					high = middle
+			return start + low
+
+		return len(records)
+
+	def getCorners(self):
+		# Corners of all files, with entry/apex/exit records numbered across
+		# them. Files without an index are read through to find them, once.
+		if self.corners is not None:
+			return self.corners
+
+		self.corners = []
+		for sessionFile, start, index in zip(self.records.files, self.records.starts, self.indexes):
+			if index is None:
+				index = SessionIndex.buildIndex(sessionFile.path, [sessionFile[i] for i in range(len(sessionFile))])
+
+			for corner in index.getCorners():
+				corner = dict(corner, file = sessionFile.path)
+				for point in ("entry", "apex", "exit"):
+					corner[point] = [corner[point][0], corner[point][1] + start] + corner[point][2:]
+				self.corners.append(corner)
+
+		return self.corners
+
+	def seekCorner(self, number, side = None):
+		# Carries on from the entry of the number-th corner (from 1), only
+		# counting corners to side ("left" or "right") when given
+		corners = [corner for corner in self.getCorners() if side is None or corner["corner"] == side]
+		if not 0 < number <= len(corners):
+			return False
+
+		self.seekRecord(corners[number - 1]["entry"][1])
+		return True
+
+	def seekRecord(self, pos):
+		self.pos = min(pos, len(self.records))
+		self.readPos = self.pos
+		self.pending = []
+		self.startTime = None
+		self.finished = self.pos == len(self.records)
+
+	def rewind(self):
+		if not self.loop:
+			self.finished = True
+			return
+
+		self.pending = self.getSamples()
+		self.timeOffset += self.records.getTime(len(self.records) - 1) - self.records.getTime(0) + self.packetInterval
+		self.pos = 0
+		self.readPos = 0
+
+	def getSamples(self):
+		# Every sample played since the last call, like GyroscopeSampler.getSamples
+		samples = self.records[self.readPos:self.pos]
+		self.readPos = self.pos
+
+		if self.timeOffset != 0:
+			samples = [(sample[0] + self.timeOffset,) + sample[1:] for sample in samples]
+
+		pending, self.pending = self.pending, []
+		return pending + samples
+
+	def display(self):
+		print "Yaw: " + str(self.yaw) + "\t Pitch: " + str(self.pitch) + "\t Roll: " + str(self.roll)
+
+class ReplaySwitch:
+	# Switch stand-in that is never pressed
+	switchState = False
+
+	def update(self):
+		pass
+
+if __name__ == "__main__":
+	# Benchmark GyroscopeHandler on recordings:
+	# python ReplaySource.py [--speed N] session.rec...
+	import GyroscopeHandler
+	import LeanStatistics
+
+	args = sys.argv[1:]
+	speed = None
+	if args and args[0] == "--speed":
+		speed = float(args[1])
+		args = args[2:]
+
+	replay = ReplaySource(args, speed)
+	handler = GyroscopeHandler.GyroscopeHandler(ReplaySwitch(), 15, 10, replay, clock = replay.getTime)
+
+	updates = 0
+	startTime = time.time()
+	while not replay.finished:
+		handler.update()
+		updates += 1
+
+	duration = time.time() - startTime
+	print("%d samples in %.2f s, %.0f updates per second" % (len(replay.records), duration, updates / max(duration, 1e-9)))
+	print("Max lean left %.1f right %.1f, rejected %s" % (
+		handler.leanStatistics.getPeak("session", LeanStatistics.LEFT),
+		handler.leanStatistics.getPeak("session", LeanStatistics.RIGHT),
+		handler.outlierFilter.getRejectedCounts()))
@@ -15,6 +15,13 @@ class RollLabelDisplay:
 		if self.gyroObj.roll < -90:
 			self.gyroObj.roll = -90
 
+		if self.gyroObj.sensorFailed:
+			# the sensor stopped answering, don't show the last readings as current
+			self.maxLeanLabel.text = "--"
+			self.leftLeanLabel.text = "L --"
+			self.rightLeanLabel.text = "R --"
+			return
+
 		if self.gyroObj.greatestVal < 10 and self.gyroObj.greatestVal > -10:
 			self.maxLeanLabel.text = "0" + str(self.gyroObj.greatestVal)
 		else:
@@ -0,0 +1,73 @@
+from array import array
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+class SampleRingBuffer:
+	"""Preallocated ring of the latest capacity samples, stored as one array
+	per field instead of a Python object per sample (28 bytes a sample).
+
+	Samples are (time, yaw, pitch, roll, rollRate, lateralAccel) with time in
+	seconds. Every sample ever appended has a sequence number, so readers can
+	ask for what is new since they last looked."""
+
+	FIELDS = ("time", "yaw", "pitch", "roll", "rollRate", "lateralAccel")
+
+	def __init__(self, capacity):
+		self.capacity = capacity
+
+		# the time needs double precision, the angles and rates don't
+		self.columns = {}
+		for field in self.FIELDS:
+			self.columns[field] = array("d" if field == "time" else "f", [0]) * capacity
+		self.columnList = [self.columns[field] for field in self.FIELDS]
+
+		# sequence number of the next sample, its slot is nextSeq % capacity
+		self.nextSeq = 0
+
+	def __len__(self):
+		return min(self.nextSeq, self.capacity)
+
+	def append(self, sample):
+		slot = self.nextSeq % self.capacity
+		for column, value in zip(self.columnList, sample):
+			column[slot] = value
+		self.nextSeq += 1
+
+	def extend(self, samples):
+		for sample in samples:
+			self.append(sample)
+
+	def getOldestSeq(self):
+		return max(self.nextSeq - self.capacity, 0)
+
+	def getSegments(self, startSeq = None):
+		# (start, stop) slot ranges holding the samples from startSeq on (all
+		# kept samples by default), oldest first. One range, or two when they
+		# wrap around the end of the arrays.
+		startSeq = self.getOldestSeq() if startSeq is None else max(startSeq, self.getOldestSeq())
+		count = self.nextSeq - startSeq
+		if count <= 0:
+			return []
+
+		start = startSeq % self.capacity
+		if start + count <= self.capacity:
+			return [(start, start + count)]
+		return [(start, self.capacity), (0, start + count - self.capacity)]
+
+	def getSamples(self, startSeq = None):
+		# Copies the samples from startSeq on out as tuples, oldest first
+		samples = []
+		for start, stop in self.getSegments(startSeq):
+			samples.extend(zip(*[column[start:stop] for column in self.columnList]))
+		return samples
+
+	def getViews(self, field, startSeq = None):
+		# Zero-copy numpy views of one field, one per segment. They share memory
+		# with the buffer, so read them before the writer wraps around.
+		column = self.columns[field]
+		dtype = numpy.float64 if column.typecode == "d" else numpy.float32
+		data = numpy.frombuffer(column, dtype)
+		return [data[start:stop] for start, stop in self.getSegments(startSeq)]
@@ -0,0 +1,127 @@
+import math
+
+# Host-side fusion of raw gyro and accel readings into an orientation, used
+# in place of the DMP by GyroscopeHardware's raw engine.
+#
+# Both filters take gyro rates in deg/s and accel in g on the sensor axes and
+# report yaw, pitch and roll in radians with the same conventions as
+# MPU6050.dmpGetYawPitchRoll, plus the gravity direction on the sensor axes.
+
+class ComplementaryFilter:
+	"""Integrates the gyro and pulls pitch and roll towards the accelerometer.
+	Cheapest option, yaw is gyro only and drifts."""
+
+	def __init__(self, gyroWeight = 0.98):
+		# how much of each update comes from the gyro, the rest from the accel
+		self.gyroWeight = gyroWeight
+
+		self.yaw = 0.0
+		self.pitch = 0.0
+		self.roll = 0.0
+		self.initialized = False
+
+	def update(self, gyro, accel, dt):
+		gx, gy, gz = gyro
+		ax, ay, az = accel
+
+		accelRoll = math.atan2(ay, math.sqrt(ax * ax + az * az))
+		accelPitch = math.atan2(ax, math.sqrt(ay * ay + az * az))
+
+		if not self.initialized:
+			self.roll = accelRoll
+			self.pitch = accelPitch
+			self.initialized = True
+			return
+
+		# the DMP's pitch and yaw turn the opposite way to the gyro's y and z
+		self.roll = self.gyroWeight * (self.roll + math.radians(gx) * dt) + (1 - self.gyroWeight) * accelRoll
+		self.pitch = self.gyroWeight * (self.pitch - math.radians(gy) * dt) + (1 - self.gyroWeight) * accelPitch
+		self.yaw -= math.radians(gz) * dt
+
+	def getGravity(self):
+		return (math.sin(self.pitch),
+			math.sin(self.roll) * math.cos(self.pitch),
+			math.cos(self.roll) * math.cos(self.pitch))
+
+class MadgwickFilter:
+	"""Madgwick's gradient descent IMU filter. Tracks a full quaternion, so it
+	has no gimbal problems at big lean angles, for a little more CPU."""
+
+	def __init__(self, beta = 0.1):
+		# gain of the accelerometer correction, higher trusts the accel more
+		self.beta = beta
+
+		self.w = 1.0
+		self.x = 0.0
+		self.y = 0.0
+		self.z = 0.0
+
+		self.yaw = 0.0
+		self.pitch = 0.0
+		self.roll = 0.0
+		self.initialized = False
+
+	def update(self, gyro, accel, dt):
+		if not self.initialized:
+			self.start(accel)
+
+		q0, q1, q2, q3 = self.w, self.x, self.y, self.z
+		gx, gy, gz = [math.radians(rate) for rate in gyro]
+		ax, ay, az = accel
+
+		# rate of change of the quaternion from the gyro
+		qDot0 = 0.5 * (-q1 * gx - q2 * gy - q3 * gz)
+		qDot1 = 0.5 * (q0 * gx + q2 * gz - q3 * gy)
+		qDot2 = 0.5 * (q0 * gy - q1 * gz + q3 * gx)
+		qDot3 = 0.5 * (q0 * gz + q1 * gy - q2 * gx)
+
+		norm = math.sqrt(ax * ax + ay * ay + az * az)
+		if norm > 0:
+			ax /= norm
+			ay /= norm
+			az /= norm
+
+			# gradient descent step towards the measured gravity direction
+			s0 = 4 * q0 * q2 * q2 + 2 * q2 * ax + 4 * q0 * q1 * q1 - 2 * q1 * ay
+			s1 = 4 * q1 * q3 * q3 - 2 * q3 * ax + 4 * q0 * q0 * q1 - 2 * q0 * ay - 4 * q1 + 8 * q1 * q1 * q1 + 8 * q1 * q2 * q2 + 4 * q1 * az
+			s2 = 4 * q0 * q0 * q2 + 2 * q0 * ax + 4 * q2 * q3 * q3 - 2 * q3 * ay - 4 * q2 + 8 * q2 * q1 * q1 + 8 * q2 * q2 * q2 + 4 * q2 * az
+			s3 = 4 * q1 * q1 * q3 - 2 * q1 * ax + 4 * q2 * q2 * q3 - 2 * q2 * ay
+
+			norm = math.sqrt(s0 * s0 + s1 * s1 + s2 * s2 + s3 * s3)
+			if norm > 0:
+				qDot0 -= self.beta * s0 / norm
+				qDot1 -= self.beta * s1 / norm
+				qDot2 -= self.beta * s2 / norm
+				qDot3 -= self.beta * s3 / norm
+
+		q0 += qDot0 * dt
+		q1 += qDot1 * dt
+		q2 += qDot2 * dt
+		q3 += qDot3 * dt
+
+		norm = math.sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)
+		self.w, self.x, self.y, self.z = q0 / norm, q1 / norm, q2 / norm, q3 / norm
+
+		# same formulas as MPU6050.dmpGetGravity and dmpGetYawPitchRoll
+		gravityX, gravityY, gravityZ = self.getGravity()
+		self.yaw = math.atan2(2 * self.x * self.y - 2 * self.w * self.z, 2 * self.w * self.w + 2 * self.x * self.x - 1)
+		self.pitch = math.atan(gravityX / math.sqrt(gravityY * gravityY + gravityZ * gravityZ))
+		self.roll = math.atan(gravityY / math.sqrt(gravityX * gravityX + gravityZ * gravityZ))
+
+	def start(self, accel):
+		# Starts from the accelerometer's pitch and roll rather than level, so
+		# the first seconds aren't spent converging (and dragging yaw along)
+		ax, ay, az = accel
+		halfRoll = math.atan2(ay, az) / 2
+		halfPitch = -math.atan2(ax, math.sqrt(ay * ay + az * az)) / 2
+
+		cr, sr = math.cos(halfRoll), math.sin(halfRoll)
+		cp, sp = math.cos(halfPitch), math.sin(halfPitch)
+		self.w, self.x, self.y, self.z = cr * cp, sr * cp, cr * sp, -sr * sp
+		self.initialized = True
+
+	def getGravity(self):
+		w, x, y, z = self.w, self.x, self.y, self.z
+		return (2 * (x * z - w * y),
+			2 * (w * x + y * z),
+			w * w - x * x - y * y + z * z)
@@ -0,0 +1,40 @@
+import mpu6050
+
+class SensorProfile:
+	"""Sample rate, DLPF bandwidth and DMP FIFO rate that belong together,
+	applied with GyroscopeHardware.setProfile."""
+
+	def __init__(self, name, rate, dlpfMode, fifoRateDivider):
+		self.name = name
+
+		# sample rate of the raw engine is 1kHz / (1 + rate), it reads every
+		# sample. The DMP always samples at 200Hz, see MPU6050_DMP_SAMPLE_RATE.
+		self.rate = rate
+		self.dlpfMode = dlpfMode
+
+		# the DMP outputs every (1 + fifoRateDivider)th of its samples
+		self.fifoRateDivider = fifoRateDivider
+
+	def getSampleRate(self):
+		return 1000.0 / (1 + self.rate)
+
+	def getDMPRate(self):
+		return 1000.0 / (1 + mpu6050.MPU6050.MPU6050_DMP_SAMPLE_RATE) / (1 + self.fifoRateDivider)
+
+MPU = mpu6050.MPU6050
+
+profiles = {
+	# 10 packets/s with heavy filtering, for riding around with the screen dimmed
+	"cruising" : SensorProfile("cruising", 9, MPU.MPU6050_DLPF_BW_20, 19),
+
+	# 33 packets/s for a 30 fps dashboard, what dmpInitialize sets up
+	"dashboard" : SensorProfile("dashboard", 4, MPU.MPU6050_DLPF_BW_42, 5),
+
+	# 100 packets/s so quick flicks between corners are caught
+	"track" : SensorProfile("track", 4, MPU.MPU6050_DLPF_BW_42, 1),
+
+	# every DMP sample at 200 packets/s, the raw engine samples at 1kHz
+	"logging" : SensorProfile("logging", 0, MPU.MPU6050_DLPF_BW_98, 0),
+}
+
+defaultProfile = "dashboard"
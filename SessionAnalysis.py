@@ -0,0 +1,239 @@
+"""Lean statistics over recorded sessions (see SessionRecorder), computed with
+numpy over whole recordings at once.
+
+python SessionAnalysis.py [--bin 5] [--thresholds 20,30,40] session.rec...
+python SessionAnalysis.py --corners session.rec...
+python SessionAnalysis.py --corner 3 --side right session.rec...
+python SessionAnalysis.py --start 600 --end 900 session.rec...
+python SessionAnalysis.py --calibration calibration.json session.rec...
+
+With the sidecar index (see SessionIndex) a corner or time range is found
+without reading the rest of the recording. Compact .lrz files (see
+CompactSession) are read as well.
+
+Angles are decoded from the recorded DMP packets with the same math as
+MPU6050.dmpGetYawPitchRoll, so they match what the live display showed.
+The packets are recorded as the sensor sent them, pass the mounting
+calibration (see Calibration) the bike was ridden with to apply it."""
+
+import os
+import sys
+import argparse
+
+import numpy
+
+import mpu6050
+import SessionRecorder
+import SessionIndex
+import CompactSession
+import Calibration
+
+# numpy view of SessionRecorder.recordStruct
+recordDtype = numpy.dtype([
+	("time", "<f8"),
+	("packet", "u1", (SessionRecorder.SessionRecorder.PACKET_SIZE,)),
+	("yaw", "<f4"),
+	("pitch", "<f4"),
+	("roll", "<f4"),
+	("rollRate", "<f4"),
+	("lateralAccel", "<f4")])
+
+# gaps longer than this (between files, or the recorder stalling) don't count
+# as time spent at the lean of the sample before them
+MAX_SAMPLE_GAP = 1.0
+
+def loadSession(path, start = None, end = None):
+	# Memory maps the records of a session file as a numpy record array,
+	# only those from time start up to end when given
+	if path.endswith(".lrz"):
+		return loadCompactSession(path, start, end)
+
+	headerStruct = SessionRecorder.SessionRecorder.headerStruct
+	with open(path, "rb") as f:
+		magic, version, recordSize, count = headerStruct.unpack(f.read(headerStruct.size))
+
+	if magic != SessionRecorder.SessionRecorder.MAGIC or recordSize != recordDtype.itemsize:
+		raise ValueError(path + " is not a session recording")
+
+	if os.path.getsize(path) < headerStruct.size + recordDtype.itemsize:
+		return numpy.zeros(0, recordDtype)
+
+	records = numpy.memmap(path, dtype = recordDtype, mode = "r", offset = headerStruct.size)
+
+	# a file that was not closed is longer than the records in it, the rest
+	# has zero times. The header counts the records flushed so far.
+	times = records["time"]
+	records = records[:SessionRecorder.findEnd(times.__getitem__, min(count, len(records)), len(records))]
+
+	# narrow down to the indexed records around the range first, then binary
+	# search in there, so only the pages of the range are read
+	if start is not None or end is not None:
+		index = SessionIndex.loadIndex(path)
+		if index is not None:
+			first = index.findRecord(start) if start is not None else 0
+			last = index.findRecordAfter(end) if end is not None else None
+			records = records[first:last]
+
+		times = records["time"]
+		if start is not None:
+			records = records[numpy.searchsorted(times, start):]
+			times = records["time"]
+		if end is not None:
+			records = records[:numpy.searchsorted(times, end, side = "right")]
+
+	return records
+
+def loadCompactSession(path, start = None, end = None):
+	# Decodes a CompactSession file into the same record array, using the
+	# index of the original file to skip the blocks before start
+	first = 0
+	index = SessionIndex.loadIndex(path[:-len(".lrz")])
+	if start is not None and index is not None:
+		first = index.findRecord(start)
+
+	recordStruct = SessionRecorder.SessionRecorder.recordStruct
+	data = []
+	for block in CompactSession.readBlocks(path, first):
+		data.extend(recordStruct.pack(*record) for record in block)
+		if end is not None and block[-1][0] > end:
+			break
+
+	records = numpy.frombuffer("".join(data), dtype = recordDtype)
+	if start is not None:
+		records = records[records["time"] >= start]
+	if end is not None:
+		records = records[records["time"] <= end]
+	return records
+
+def loadSessions(paths, start = None, end = None):
+	records = numpy.concatenate([loadSession(path, start, end) for path in paths])
+	return records[numpy.argsort(records["time"], kind = "mergesort")]
+
+def getStartTime(paths):
+	# Time of the first record of a set of session files
+	times = [records["time"][0] for records in map(loadSession, paths) if len(records)]
+	return min(times) if times else 0
+
+def loadCorners(paths):
+	# Every corner of the sessions in time order, from their indexes
+	corners = []
+	for path in paths:
+		index = SessionIndex.loadIndex(path[:-len(".lrz")] if path.endswith(".lrz") else path)
+		if index is None:
+			print("No index for " + path + ", building one")
+			records = loadSession(path)
+			index = SessionIndex.buildIndex(path, zip(records["time"], records["packet"], records["yaw"], records["pitch"], records["roll"]))
+		corners.extend(index.getCorners())
+
+	return sorted(corners, key = lambda corner: corner["entry"][0])
+
+def decodeSession(records, mounting = None):
+	# Returns roll (deg) and roll rate (deg/s) of every record, decoded from the
+	# packets where there are any, the recorded values with the raw engine.
+	mounting = mpu6050.getMounting(mounting)
+
+	roll = records["roll"].astype(numpy.float64)
+	rollRate = records["rollRate"].astype(numpy.float64)
+
+	packets = records["packet"]
+	hasPacket = packets.any(axis = 1)
+	if hasPacket.any():
+		data = packets[hasPacket].tobytes()
+		q = mpu6050.dmpGetQuaternionBatch(data, mounting)
+		ypr = mpu6050.dmpGetYawPitchRollBatch(q, mpu6050.dmpGetGravityBatch(q))
+		roll[hasPacket] = numpy.degrees(ypr[:, 2])
+		rollRate[hasPacket] = mpu6050.dmpGetGyroBatch(data, mounting)[:, 0]
+
+	return roll, rollRate
+
+def getSampleDurations(times):
+	# Seconds each sample stands for, up to the next one
+	durations = numpy.diff(times)
+	if len(durations) == 0:
+		return numpy.zeros(len(times))
+
+	typical = numpy.median(durations)
+	durations = numpy.where(durations > MAX_SAMPLE_GAP, typical, durations)
+	return numpy.append(durations, typical)
+
+def analyse(records, binSize = 5.0, thresholds = (20, 30, 40), mounting = None):
+	# Returns a dict of the statistics printed by report()
+	roll, rollRate = decodeSession(records, mounting)
+	durations = getSampleDurations(records["time"])
+
+	lean = numpy.abs(roll)
+	left = roll < 0
+	right = ~left
+
+	edges = numpy.arange(0, 90 + binSize, binSize)
+	result = {
+		"samples" : len(records),
+		"duration" : durations.sum(),
+		"peakLeft" : lean[left].max() if left.any() else 0,
+		"peakRight" : lean[right].max() if right.any() else 0,
+		"edges" : edges,
+		"histogramLeft" : numpy.histogram(lean[left], edges, weights = durations[left])[0],
+		"histogramRight" : numpy.histogram(lean[right], edges, weights = durations[right])[0],
+		"timeAbove" : [(threshold, durations[lean >= threshold].sum()) for threshold in thresholds],
+		"rollRatePercentiles" : [(p, numpy.percentile(numpy.abs(rollRate), p)) for p in (50, 90, 99, 100)] if len(rollRate) else [],
+	}
+
+	return result
+
+def report(result):
+	print("%d samples, %.1f s" % (result["samples"], result["duration"]))
+	print("Peak lean left %.1f right %.1f" % (result["peakLeft"], result["peakRight"]))
+
+	print("\nLean        left (s)  right (s)")
+	edges = result["edges"]
+	for i in range(len(edges) - 1):
+		print("%3d-%-3d  %10.1f %10.1f" % (edges[i], edges[i + 1], result["histogramLeft"][i], result["histogramRight"][i]))
+
+	print("")
+	for threshold, seconds in result["timeAbove"]:
+		print("Time at %d deg or more: %.1f s" % (threshold, seconds))
+
+	print("")
+	for p, rate in result["rollRatePercentiles"]:
+		print("Roll rate %d%%: %.1f deg/s" % (p, rate))
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description = "Lean statistics over recorded sessions")
+	parser.add_argument("paths", nargs = "+", help = "session files")
+	parser.add_argument("--bin", type = float, default = 5.0, help = "histogram bin size in degrees")
+	parser.add_argument("--thresholds", default = "20,30,40", help = "comma separated lean angles to report time above")
+	parser.add_argument("--start", type = float, help = "only from this many seconds into the session")
+	parser.add_argument("--end", type = float, help = "only up to this many seconds into the session")
+	parser.add_argument("--corners", action = "store_true", help = "list the corners instead")
+	parser.add_argument("--corner", type = int, help = "only the corner with this number, from 1")
+	parser.add_argument("--side", choices = ("left", "right"), help = "only count corners to this side")
+	parser.add_argument("--calibration", help = "mounting calibration file to decode the packets with")
+	args = parser.parse_args()
+
+	startTime = getStartTime(args.paths)
+	start = None if args.start is None else startTime + args.start
+	end = None if args.end is None else startTime + args.end
+
+	if args.corners or args.corner is not None:
+		corners = [corner for corner in loadCorners(args.paths) if args.side is None or corner["corner"] == args.side]
+
+		if args.corners:
+			for number, corner in enumerate(corners, 1):
+				print("%3d %-5s %8.1f s  %5.1f deg  %4.1f s" % (number, corner["corner"], corner["entry"][0] - startTime,
+					corner["apex"][2], corner["exit"][0] - corner["entry"][0]))
+			sys.exit(0)
+
+		if not 0 < args.corner <= len(corners):
+			print("There are %d corners" % len(corners))
+			sys.exit(1)
+
+		corner = corners[args.corner - 1]
+		start, end = corner["entry"][0], corner["exit"][0]
+
+	records = loadSessions(args.paths, start, end)
+	if len(records) == 0:
+		print("No samples in " + ", ".join(args.paths))
+		sys.exit(1)
+
+	mounting = Calibration.load(args.calibration) if args.calibration is not None else None
+	report(analyse(records, args.bin, [float(t) for t in args.thresholds.split(",")], mounting))
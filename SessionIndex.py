@@ -0,0 +1,145 @@
+import os
+import json
+from bisect import bisect_left, bisect_right
+
+# Sidecar index of a session file (see SessionRecorder), stored next to it as
+# <session>.idx. One JSON object per line, appended while recording:
+#   {"t": time, "r": record}                    every interval seconds
+#   {"corner": side, "entry": [time, record], "apex": [time, record, lean],
+#    "exit": [time, record]}                    for every corner detected
+# Records are numbered from 0, record n starts at header size + n * record size.
+
+def getIndexPath(sessionPath):
+	return sessionPath + ".idx"
+
+class CornerDetector:
+	"""Splits a stream of roll readings into corners. A corner starts when the
+	lean reaches enterThreshold and ends when it drops below exitThreshold,
+	the gap between the two keeps noise from splitting corners."""
+
+	def __init__(self, enterThreshold = 15.0, exitThreshold = 8.0):
+		self.enterThreshold = enterThreshold
+		self.exitThreshold = exitThreshold
+
+		# the corner being ridden, None on the straights
+		self.corner = None
+
+	def add(self, time, record, roll):
+		# Returns the corner that ended with this reading, or None
+		lean = abs(roll)
+		side = "left" if roll < 0 else "right"
+
+		if self.corner is None:
+			if lean >= self.enterThreshold:
+				self.corner = {"corner" : side, "entry" : [time, record], "apex" : [time, record, lean]}
+			return None
+
+		# flicking straight into a corner the other way ends this one
+		if lean < self.exitThreshold or side != self.corner["corner"]:
+			corner = self.corner
+			corner["exit"] = [time, record]
+			self.corner = None
+
+			if lean >= self.enterThreshold:
+				self.corner = {"corner" : side, "entry" : [time, record], "apex" : [time, record, lean]}
+			return corner
+
+		if lean > self.corner["apex"][2]:
+			self.corner["apex"] = [time, record, lean]
+
+		return None
+
+class SessionIndexWriter:
+	"""Builds the index of a session file as its records are written"""
+
+	def __init__(self, sessionPath, interval = 1.0, enterThreshold = 15.0, exitThreshold = 8.0):
+		self.file = open(getIndexPath(sessionPath), "w")
+		self.interval = interval
+		self.nextTime = None
+		self.cornerDetector = CornerDetector(enterThreshold, exitThreshold)
+
+	def add(self, record, time, roll):
+		if self.nextTime is None or time >= self.nextTime:
+			self.write({"t" : time, "r" : record})
+			self.nextTime = time + self.interval
+
+		corner = self.cornerDetector.add(time, record, roll)
+		if corner is not None:
+			self.write(corner)
+
+	def write(self, entry):
+		self.file.write(json.dumps(entry) + "\n")
+
+	def flush(self):
+		self.file.flush()
+		os.fsync(self.file.fileno())
+
+	def close(self):
+		self.flush()
+		self.file.close()
+
+class SessionIndex:
+	"""Time to record lookup and the corners of one session file"""
+
+	def __init__(self, times, records, corners, sessionPath = None):
+		self.times = times
+		self.records = records
+		self.corners = corners
+		self.sessionPath = sessionPath
+
+	def findRecord(self, time):
+		# Number of the indexed record at or just before time, the exact record
+		# is at most interval seconds of records further on
+		pos = bisect_left(self.times, time)
+		if pos < len(self.times) and self.times[pos] == time:
+			return self.records[pos]
+		if pos == 0:
+			return 0
+		return self.records[pos - 1]
+
+	def findRecordAfter(self, time):
+		# Number of the first indexed record after time, None when there is none
+		pos = bisect_right(self.times, time)
+		if pos == len(self.times):
+			return None
+		return self.records[pos]
+
+	def getCorners(self, side = None):
+		return [corner for corner in self.corners if side is None or corner["corner"] == side]
+
+def loadIndex(sessionPath):
+	# Returns the SessionIndex of a session file, None when it has no index
+	times = []
+	records = []
+	corners = []
+
+	try:
+		with open(getIndexPath(sessionPath)) as f:
+			for line in f:
+				try:
+					entry = json.loads(line)
+				except ValueError:
+					# the last line of an index that was not closed
+					break
+
+				if "corner" in entry:
+					corners.append(entry)
+				else:
+					times.append(entry["t"])
+					records.append(entry["r"])
+	except IOError:
+		return None
+
+	return SessionIndex(times, records, corners, sessionPath)
+
+def buildIndex(sessionPath, records, enterThreshold = 15.0, exitThreshold = 8.0):
+	# Corners of already loaded (time, packet, yaw, pitch, roll, ...) records,
+	# for sessions recorded without an index
+	cornerDetector = CornerDetector(enterThreshold, exitThreshold)
+	corners = []
+	for i, record in enumerate(records):
+		corner = cornerDetector.add(record[0], i, record[4])
+		if corner is not None:
+			corners.append(corner)
+
+	return SessionIndex([record[0] for record in records], range(len(records)), corners, sessionPath)
@@ -0,0 +1,261 @@
+import os
+import time
+import mmap
+import Queue
+import threading
+from struct import Struct
+
+import SessionIndex
+
+class SessionRecorder:
+	"""Appends every sample to fixed-size binary records in a preallocated,
+	memory-mapped file, starting a new file when one is full.
+
+	Records are written by a thread of their own and flushed to the card in
+	batches, so neither the sampler nor the display waits on the SD card.
+
+	File layout: a header (magic, version, record size, record count) followed
+	by records of time (float64 seconds), the raw 42-byte DMP packet (zeros
+	with the raw engine) and yaw, pitch, roll (deg), roll rate (deg/s) and
+	lateral acceleration (g) as float32, all little-endian. Every file gets a
+	sidecar index of times and corners, see SessionIndex."""
+
+	MAGIC = "LEANREC1"
+	VERSION = 1
+
+	headerStruct = Struct('<8sIIQ8x')
+	recordStruct = Struct('<d42s5f')
+
+	PACKET_SIZE = 42
+
+	# bytes of zeros written at a time when a file is preallocated
+	PREALLOCATE_CHUNK = 1024 * 1024
+
+	def __init__(self, directory, fileSize = 64 * 1024 * 1024, flushInterval = 2.0, indexInterval = 1.0, compact = False):
+		# fileSize is the size files are preallocated to and rotated at,
+		# flushInterval the seconds between syncs to the card and
+		# indexInterval the seconds between time index entries.
+		# With compact, finished files are replaced by a CompactSession file.
+		self.directory = directory
+		self.compact = compact
+		self.recordsPerFile = (fileSize - self.headerStruct.size) // self.recordStruct.size
+		self.flushInterval = flushInterval
+		self.indexInterval = indexInterval
+
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+
+		self.queue = Queue.Queue()
+		self.file = None
+		self.map = None
+		self.index = None
+		self.path = None
+		self.count = 0
+		self.fileNumber = 0
+
+		# records written and batches dropped since the start
+		self.recorded = 0
+		self.dropped = 0
+
+		self.running = True
+		self.thread = threading.Thread(target = self.run)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def record(self, samples, packetData = None):
+		# Queues (time, yaw, pitch, roll, rollRate, lateralAccel) samples and the
+		# packetData they were decoded from, never blocks
+		if not self.running:
+			self.dropped += 1
+			return
+
+		self.queue.put((samples, packetData))
+
+	def close(self):
+		# Writes what is still queued and closes the file
+		if self.thread is None:
+			return
+
+		self.running = False
+		self.queue.put(None)
+		self.thread.join()
+		self.thread = None
+
+	def run(self):
+		lastFlush = time.time()
+
+		while True:
+			try:
+				item = self.queue.get(timeout = self.flushInterval)
+			except Queue.Empty:
+				item = False
+
+			if item is None:
+				break
+
+			try:
+				if item:
+					self.write(*item)
+
+				if time.time() - lastFlush >= self.flushInterval:
+					self.flush()
+					lastFlush = time.time()
+			except (IOError, OSError):
+				print "Error writing " + str(self.path) + ", recording stopped"
+				self.running = False
+				break
+
+		self.closeFile()
+
+	def write(self, samples, packetData):
+		empty = "\0" * self.PACKET_SIZE
+
+		for i, sample in enumerate(samples):
+			if self.map is None or self.count == self.recordsPerFile:
+				self.openFile()
+
+			if packetData is None:
+				packet = empty
+			else:
+				packet = bytes(packetData[i * self.PACKET_SIZE:(i + 1) * self.PACKET_SIZE])
+
+			offset = self.headerStruct.size + self.count * self.recordStruct.size
+			self.recordStruct.pack_into(self.map, offset, sample[0], packet, *sample[1:6])
+			self.index.add(self.count, sample[0], sample[3])
+			self.count += 1
+			self.recorded += 1
+
+	def openFile(self):
+		self.closeFile()
+
+		self.fileNumber += 1
+		name = time.strftime("session-%Y%m%d-%H%M%S") + "-%03d.rec" % self.fileNumber
+		self.path = os.path.join(self.directory, name)
+
+		# Zeros are written over the whole file so its blocks are allocated
+		# now. A sparse file would leave a full card to show up as a SIGBUS
+		# in the middle of writing through the map, this is an IOError here.
+		size = self.headerStruct.size + self.recordsPerFile * self.recordStruct.size
+		self.file = open(self.path, "w+b")
+		chunk = "\0" * self.PREALLOCATE_CHUNK
+		for start in range(0, size, self.PREALLOCATE_CHUNK):
+			self.file.write(chunk[:size - start])
+		self.file.flush()
+		self.map = mmap.mmap(self.file.fileno(), size)
+		self.count = 0
+		self.writeHeader()
+
+		self.index = SessionIndex.SessionIndexWriter(self.path, self.indexInterval)
+
+	def writeHeader(self):
+		self.headerStruct.pack_into(self.map, 0, self.MAGIC, self.VERSION, self.recordStruct.size, self.count)
+
+	def flush(self):
+		# The count in the header only ever covers records that are on the card
+		if self.map is None:
+			return
+
+		self.map.flush()
+		self.writeHeader()
+
+		# only the header page is dirty by now
+		self.map.flush()
+		os.fsync(self.file.fileno())
+
+		self.index.flush()
+
+	def closeFile(self):
+		if self.map is None:
+			return
+
+		self.flush()
+		self.map.close()
+
+		# only keep the records actually written
+		self.file.truncate(self.headerStruct.size + self.count * self.recordStruct.size)
+		self.file.close()
+		self.index.close()
+		self.map = None
+		self.file = None
+		self.index = None
+
+		if self.compact:
+			import CompactSession
+			CompactSession.compressSession(self.path)
+			os.remove(self.path)
+
+def findEnd(getTime, start, end):
+	# Number of records before the first zero time from start on, by binary
+	# search. A file that was not closed has zero times after its records.
+	while start < end:
+		middle = (start + end) // 2
+		if getTime(middle) == 0:
+			end = middle
+		else:
+			start = middle + 1
+	return start
+
+class SessionFile:
+	"""Random access to the records of a session file through mmap, only the
+	pages of the records read are loaded"""
+
+	timeStruct = Struct('<d')
+
+	def __init__(self, path):
+		headerStruct = SessionRecorder.headerStruct
+		self.path = path
+		self.file = open(path, "rb")
+		header = self.file.read(headerStruct.size)
+		if len(header) < headerStruct.size:
+			raise ValueError(path + " is not a session recording")
+
+		magic, version, recordSize, count = headerStruct.unpack(header)
+		if magic != SessionRecorder.MAGIC or recordSize != SessionRecorder.recordStruct.size:
+			raise ValueError(path + " is not a session recording")
+
+		self.map = None
+		self.count = 0
+
+		capacity = (os.path.getsize(path) - headerStruct.size) // recordSize
+		if capacity > 0:
+			self.map = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+
+			# the header counts the records flushed so far
+			self.count = findEnd(self.getTime, min(count, capacity), capacity)
+
+	def __len__(self):
+		return self.count
+
+	def __getitem__(self, i):
+		# (time, packet, yaw, pitch, roll, rollRate, lateralAccel) of record i
+		return SessionRecorder.recordStruct.unpack_from(self.map, SessionRecorder.headerStruct.size + i * SessionRecorder.recordStruct.size)
+
+	def getTime(self, i):
+		return self.timeStruct.unpack_from(self.map, SessionRecorder.headerStruct.size + i * SessionRecorder.recordStruct.size)[0]
+
+	def close(self):
+		if self.map is not None:
+			self.map.close()
+		self.file.close()
+
+def readRecords(path):
+	# Returns the (time, packet, yaw, pitch, roll, rollRate, lateralAccel)
+	# records of a session file
+	with open(path, "rb") as f:
+		data = f.read()
+
+	magic, version, recordSize, count = SessionRecorder.headerStruct.unpack_from(data)
+	if magic != SessionRecorder.MAGIC or recordSize != SessionRecorder.recordStruct.size:
+		raise ValueError(path + " is not a session recording")
+
+	# a file that was not closed may hold more records than the header says
+	count = max(count, (len(data) - SessionRecorder.headerStruct.size) // recordSize)
+
+	records = []
+	for i in range(count):
+		record = SessionRecorder.recordStruct.unpack_from(data, SessionRecorder.headerStruct.size + i * recordSize)
+		if record[0] == 0:
+			break
+		records.append(record)
+
+	return records
@@ -0,0 +1,73 @@
+"""Stand-in for the parts of RPi.GPIO used by this project, so code that waits
+on GPIO pins can run and be tested without a Raspberry Pi. Import it in place
+of RPi.GPIO and drive the inputs with setInput()."""
+
+import threading
+
+BCM = 11
+BOARD = 10
+
+IN = 1
+OUT = 0
+
+PUD_OFF = 20
+PUD_DOWN = 21
+PUD_UP = 22
+
+RISING = 31
+FALLING = 32
+BOTH = 33
+
+mode = None
+levels = {}
+callbacks = {}
+lock = threading.Lock()
+
+def setmode(newMode):
+	global mode
+	mode = newMode
+
+def setup(channel, direction, pull_up_down = PUD_OFF, initial = 0):
+	with lock:
+		levels[channel] = 1 if pull_up_down == PUD_UP else initial
+
+def input(channel):
+	return levels.get(channel, 0)
+
+def output(channel, value):
+	setInput(channel, value)
+
+def add_event_detect(channel, edge, callback = None, bouncetime = 0):
+	with lock:
+		callbacks[channel] = (edge, callback)
+
+def remove_event_detect(channel):
+	with lock:
+		callbacks.pop(channel, None)
+
+def cleanup(channel = None):
+	with lock:
+		if channel is None:
+			levels.clear()
+			callbacks.clear()
+		else:
+			levels.pop(channel, None)
+			callbacks.pop(channel, None)
+
+def setInput(channel, value):
+	# Changes the level of a pin, firing its edge callback like the real library
+	with lock:
+		previous = levels.get(channel, 0)
+		levels[channel] = value
+		edge, callback = callbacks.get(channel, (None, None))
+
+	if callback is None or previous == value:
+		return
+
+	if edge == BOTH or (edge == RISING and value) or (edge == FALLING and not value):
+		callback(channel)
+
+def pulse(channel):
+	# A short high pulse, as the MPU6050 gives on its INT pin
+	setInput(channel, 1)
+	setInput(channel, 0)
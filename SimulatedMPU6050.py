@@ -0,0 +1,430 @@
+import time
+import math
+import threading
+
+from mpu6050 import MPU6050
+
+# Motion profiles, each returns (yaw, pitch, roll) in degrees for a time in seconds
+
+def stationaryMotion(roll = 0, pitch = 0, yaw = 0):
+	return lambda t: (yaw, pitch, roll)
+
+def leanSweepMotion(maxLean = 45, period = 4.0):
+	# Leans from one side to the other and back every period seconds
+	return lambda t: (0, 0, maxLean * math.sin(2 * math.pi * t / period))
+
+def steadyCornerMotion(lean = 40, yawRate = 20):
+	# Holds a lean while turning at yawRate deg/s, the accelerometer sees
+	# nothing change though the bike rotates
+	return lambda t: (yawRate * t, 0, lean)
+
+class SimulatedMPU6050:
+	"""In-process stand-in for an MPU6050 on the I2C bus, for running
+	MPU6050 and GyroscopeHardware without the hardware"""
+
+	FIFO_SIZE = 1024
+
+	# accelerometer high pass cutoff in Hz for the ACCEL_HPF modes
+	DHPF_CUTOFFS = {
+		MPU6050.MPU6050_DHPF_5: 5.0,
+		MPU6050.MPU6050_DHPF_2P5: 2.5,
+		MPU6050.MPU6050_DHPF_1P25: 1.25,
+		MPU6050.MPU6050_DHPF_0P63: 0.63,
+	}
+	MEMORY_SIZE = 32 * MPU6050.MPU6050_DMP_MEMORY_BANK_SIZE
+
+	def __init__(self, motion = None, trace = None, latency = 0, clock = time.time, gpio = None, intPin = None, gyroBias = (0, 0, 0)):
+		# motion is a profile function (see leanSweepMotion), trace a recorded
+		# list of DMP packets that is replayed in a loop instead.
+		# latency is the time in seconds every bus transaction takes.
+		# With a gpio module (see SimulatedGPIO) and intPin the INT pin is
+		# pulsed for every DMP packet or raw sample, from a thread running in
+		# real time.
+		# gyroBias (deg/s per axis) is added to the gyro registers, less the
+		# user offsets written to the chip.
+		if motion is None:
+			motion = stationaryMotion()
+
+		self.gyroBias = gyroBias
+
+		self.motion = motion
+		self.trace = trace
+		self.tracePos = 0
+		self.latency = latency
+		self.clock = clock
+
+		self.transactions = 0
+		self.lock = threading.RLock()
+
+		self.memory = bytearray(self.MEMORY_SIZE)
+		self.powerOn()
+
+		self.gpio = gpio
+		self.intPin = intPin
+		self.running = gpio is not None and intPin is not None
+		if self.running:
+			thread = threading.Thread(target = self.runInterruptTimer)
+			thread.daemon = True
+			thread.start()
+
+	def close(self):
+		self.running = False
+
+	def runInterruptTimer(self):
+		# Without bus traffic nothing else would make the DMP produce packets
+		while self.running:
+			with self.lock:
+				self.updateFIFO()
+				self.updateSensors()
+				if self.dmpRunning():
+					delay = self.getPacketInterval()
+					lastTime = self.lastPacketTime
+				else:
+					delay = self.getSampleInterval()
+					lastTime = self.lastSampleTime
+				if lastTime is not None:
+					delay += lastTime - self.clock()
+			time.sleep(max(delay, 0))
+
+	def powerOn(self):
+		self.registers = bytearray(128)
+		self.registers[MPU6050.MPU6050_RA_PWR_MGMT_1] = 1 << MPU6050.MPU6050_PWR1_SLEEP_BIT
+		self.registers[MPU6050.MPU6050_RA_WHO_AM_I] = MPU6050.MPU6050_DEFAULT_ADDRESS
+
+		self.fifo = bytearray()
+		self.startTime = self.clock()
+		self.lastPacketTime = None
+		self.lastAngles = None
+		self.lastSampleTime = None
+		self.lastSampleAngles = None
+		self.accelLowPass = None
+
+	# smbus.SMBus interface used by PyComms
+
+	def read_byte_data(self, address, reg):
+		with self.lock:
+			self.transaction()
+			return self.readRegister(reg)
+
+	def write_byte_data(self, address, reg, value):
+		with self.lock:
+			self.transaction()
+			self.writeRegister(reg, value)
+
+	def read_i2c_block_data(self, address, reg, length):
+		with self.lock:
+			self.transaction()
+			data = []
+			for i in range(length):
+				data.append(self.readRegister(reg))
+				reg = self.nextRegister(reg)
+			return data
+
+	def write_i2c_block_data(self, address, reg, data):
+		with self.lock:
+			self.transaction()
+			for value in data:
+				self.writeRegister(reg, value)
+				reg = self.nextRegister(reg)
+
+	def transaction(self):
+		self.transactions += 1
+		if self.latency > 0:
+			time.sleep(self.latency)
+		self.updateFIFO()
+		self.updateSensors()
+
+	def nextRegister(self, reg):
+		# The FIFO and memory ports stay put during a burst, everything else increments
+		if reg in (MPU6050.MPU6050_RA_FIFO_R_W, MPU6050.MPU6050_RA_MEM_R_W):
+			return reg
+		return reg + 1
+
+	# Register file
+
+	def readRegister(self, reg):
+		if reg == MPU6050.MPU6050_RA_FIFO_R_W:
+			if not self.fifo:
+				return 0
+			value = self.fifo[0]
+			del self.fifo[0]
+			return value
+
+		if reg == MPU6050.MPU6050_RA_FIFO_COUNTH:
+			return len(self.fifo) >> 8
+
+		if reg == MPU6050.MPU6050_RA_FIFO_COUNTL:
+			return len(self.fifo) & 0xFF
+
+		if reg == MPU6050.MPU6050_RA_MEM_R_W:
+			value = self.memory[self.memoryAddress()]
+			self.advanceMemoryAddress()
+			return value
+
+		value = self.registers[reg]
+
+		# interrupt status is cleared by reading it
+		if reg == MPU6050.MPU6050_RA_INT_STATUS:
+			self.registers[reg] = 0
+
+		return value
+
+	def writeRegister(self, reg, value):
+		value &= 0xFF
+
+		if reg == MPU6050.MPU6050_RA_FIFO_R_W:
+			self.pushFIFO(bytearray([value]))
+			return
+
+		if reg == MPU6050.MPU6050_RA_MEM_R_W:
+			self.memory[self.memoryAddress()] = value
+			self.advanceMemoryAddress()
+			return
+
+		if reg == MPU6050.MPU6050_RA_PWR_MGMT_1 and value & (1 << MPU6050.MPU6050_PWR1_DEVICE_RESET_BIT):
+			# the DMP memory survives a reset, only losing power clears it
+			self.powerOn()
+			return
+
+		if reg == MPU6050.MPU6050_RA_USER_CTRL:
+			if value & (1 << MPU6050.MPU6050_USERCTRL_FIFO_RESET_BIT):
+				self.fifo = bytearray()
+
+			# reset bits clear themselves
+			value &= 0xF0
+
+		if reg == MPU6050.MPU6050_RA_SIGNAL_PATH_RESET:
+			value = 0
+
+		self.registers[reg] = value
+
+		# the DMP starts producing packets as soon as it is enabled
+		if self.lastPacketTime is None and self.dmpRunning():
+			self.lastPacketTime = self.clock()
+
+	def memoryAddress(self):
+		bank = self.registers[MPU6050.MPU6050_RA_BANK_SEL] & 0x1F
+		return bank * MPU6050.MPU6050_DMP_MEMORY_BANK_SIZE + self.registers[MPU6050.MPU6050_RA_MEM_START_ADDR]
+
+	def advanceMemoryAddress(self):
+		# the address wraps within the bank, the bank is never advanced
+		address = self.registers[MPU6050.MPU6050_RA_MEM_START_ADDR]
+		self.registers[MPU6050.MPU6050_RA_MEM_START_ADDR] = (address + 1) & 0xFF
+
+	# FIFO
+
+	def dmpRunning(self):
+		userCtrl = self.registers[MPU6050.MPU6050_RA_USER_CTRL]
+		return userCtrl & (1 << MPU6050.MPU6050_USERCTRL_DMP_EN_BIT) and userCtrl & (1 << MPU6050.MPU6050_USERCTRL_FIFO_EN_BIT)
+
+	def getPacketInterval(self):
+		# the DMP outputs at the sample rate, 1kHz / (1 + SMPLRT_DIV), divided
+		# by 1 + the FIFO rate divider in its memory
+		pos = MPU6050.MPU6050_DMP_FIFO_RATE_BANK * MPU6050.MPU6050_DMP_MEMORY_BANK_SIZE + MPU6050.MPU6050_DMP_FIFO_RATE_ADDRESS
+		divider = (self.memory[pos] << 8) | self.memory[pos + 1]
+		return (1 + self.registers[MPU6050.MPU6050_RA_SMPLRT_DIV]) / 1000.0 * (1 + divider)
+
+	def updateFIFO(self):
+		# Queues every packet the DMP would have produced since the last transaction
+		now = self.clock()
+		if not self.dmpRunning():
+			self.lastPacketTime = None
+			return
+
+		interval = self.getPacketInterval()
+		if self.lastPacketTime is None:
+			self.lastPacketTime = now
+			return
+
+		while now - self.lastPacketTime >= interval:
+			self.lastPacketTime += interval
+			self.pushFIFO(self.nextPacket(self.lastPacketTime - self.startTime, interval))
+			self.registers[MPU6050.MPU6050_RA_INT_STATUS] |= 1 << MPU6050.MPU6050_INTERRUPT_DMP_INT_BIT
+
+			if self.intPin is not None and self.registers[MPU6050.MPU6050_RA_INT_ENABLE] & (1 << MPU6050.MPU6050_INTERRUPT_DMP_INT_BIT):
+				self.gpio.pulse(self.intPin)
+
+	def pushFIFO(self, data):
+		self.fifo.extend(data)
+
+		# on overflow the oldest bytes are overwritten
+		if len(self.fifo) > self.FIFO_SIZE:
+			del self.fifo[:len(self.fifo) - self.FIFO_SIZE]
+			self.registers[MPU6050.MPU6050_RA_INT_STATUS] |= 1 << MPU6050.MPU6050_INTERRUPT_FIFO_OFLOW_BIT
+
+	def nextPacket(self, t, interval):
+		if self.trace:
+			packet = bytearray(self.trace[self.tracePos])
+			self.tracePos = (self.tracePos + 1) % len(self.trace)
+			return packet
+
+		angles = self.motion(t)
+		if self.lastAngles is None:
+			self.lastAngles = angles
+		rates = [(a - b) / interval for a, b in zip(angles, self.lastAngles)]
+		self.lastAngles = angles
+
+		return self.encodePacket(angles, rates)
+
+	def orientation(self, angles):
+		# Quaternion and gravity vector on the sensor axes for (yaw, pitch, roll) in degrees
+		yaw, pitch, roll = [math.radians(a) / 2 for a in angles]
+
+		# the DMP formulas report pitch and yaw with the opposite sign
+		cy, sy = math.cos(-yaw), math.sin(-yaw)
+		cp, sp = math.cos(-pitch), math.sin(-pitch)
+		cr, sr = math.cos(roll), math.sin(roll)
+
+		w = cr * cp * cy + sr * sp * sy
+		x = sr * cp * cy - cr * sp * sy
+		y = cr * sp * cy + sr * cp * sy
+		z = cr * cp * sy - sr * sp * cy
+
+		gx = 2 * (x * z - w * y)
+		gy = 2 * (w * x + y * z)
+		gz = w * w - x * x - y * y + z * z
+
+		return (w, x, y, z), (gx, gy, gz)
+
+	def encodePacket(self, angles, rates):
+		# Builds a 42-byte DMP packet for the given (yaw, pitch, roll) in degrees
+		# and their rates in deg/s, laid out as documented in MPU6050
+		(w, x, y, z), (gx, gy, gz) = self.orientation(angles)
+		yawRate, pitchRate, rollRate = rates
+
+		packet = bytearray(MPU6050.dmpPacketSize)
+		fields = [
+			(0, w * MPU6050.MPU6050_DMP_QUATERNION_SCALE),
+			(4, x * MPU6050.MPU6050_DMP_QUATERNION_SCALE),
+			(8, y * MPU6050.MPU6050_DMP_QUATERNION_SCALE),
+			(12, z * MPU6050.MPU6050_DMP_QUATERNION_SCALE),
+			(16, rollRate * MPU6050.MPU6050_DMP_GYRO_SCALE),
+			(20, -pitchRate * MPU6050.MPU6050_DMP_GYRO_SCALE),
+			(24, -yawRate * MPU6050.MPU6050_DMP_GYRO_SCALE),
+			(28, gx * MPU6050.MPU6050_DMP_ACCEL_SCALE),
+			(32, gy * MPU6050.MPU6050_DMP_ACCEL_SCALE),
+			(36, gz * MPU6050.MPU6050_DMP_ACCEL_SCALE)]
+
+		for pos, value in fields:
+			self.putWord(packet, pos, value)
+
+		return packet
+
+	def putWord(self, data, pos, value):
+		value = max(-32768, min(32767, int(round(value)))) & 0xFFFF
+		data[pos] = value >> 8
+		data[pos + 1] = value & 0xFF
+
+	# Raw sensors
+
+	def sensorsRunning(self):
+		# the sensor registers update at the sample rate while awake, with the
+		# DMP running too
+		sleeping = self.registers[MPU6050.MPU6050_RA_PWR_MGMT_1] & (1 << MPU6050.MPU6050_PWR1_SLEEP_BIT)
+		return not sleeping
+
+	def getSampleInterval(self):
+		# 1kHz / (1 + SMPLRT_DIV), the DLPF is assumed to be on
+		return (1 + self.registers[MPU6050.MPU6050_RA_SMPLRT_DIV]) / 1000.0
+
+	def updateSensors(self):
+		# Latches a new sample into ACCEL_XOUT_H..GYRO_ZOUT_L for every sample
+		# period passed, only the newest one is left to read like on the chip
+		now = self.clock()
+		if not self.sensorsRunning():
+			self.lastSampleTime = None
+			return
+
+		if self.lastSampleTime is None:
+			self.lastSampleTime = now
+			return
+
+		interval = self.getSampleInterval()
+		if now - self.lastSampleTime < interval:
+			return
+
+		samples = int((now - self.lastSampleTime) / interval)
+		self.lastSampleTime += samples * interval
+		self.latchSensors(self.lastSampleTime - self.startTime, samples * interval)
+		self.registers[MPU6050.MPU6050_RA_INT_STATUS] |= 1 << MPU6050.MPU6050_INTERRUPT_DATA_RDY_BIT
+
+		if self.intPin is not None and self.registers[MPU6050.MPU6050_RA_INT_ENABLE] & (1 << MPU6050.MPU6050_INTERRUPT_DATA_RDY_BIT):
+			self.gpio.pulse(self.intPin)
+
+	def latchSensors(self, t, interval):
+		angles = self.motion(t)
+		if self.lastSampleAngles is None:
+			self.lastSampleAngles = angles
+		yawRate, pitchRate, rollRate = [(a - b) / interval for a, b in zip(angles, self.lastSampleAngles)]
+		self.lastSampleAngles = angles
+
+		gravity = self.orientation(angles)[1]
+
+		# scale by the full scale ranges in bits 4:3 of the config registers
+		gyroRange = (self.registers[MPU6050.MPU6050_RA_GYRO_CONFIG] >> 3) & 0x03
+		accelRange = (self.registers[MPU6050.MPU6050_RA_ACCEL_CONFIG] >> 3) & 0x03
+		gyroScale = MPU6050.MPU6050_GYRO_LSB_PER_DPS / (1 << gyroRange)
+		accelScale = MPU6050.MPU6050_ACCEL_LSB_PER_G / (1 << accelRange)
+
+		# the same sign conventions as encodePacket
+		rates = [rollRate, -pitchRate, -yawRate]
+		values = [value * accelScale for value in gravity]
+		values.append((25 - 36.53) * 340)
+		values.extend([(rate + error) * gyroScale for rate, error in zip(rates, self.getGyroError())])
+
+		for i, value in enumerate(values):
+			self.putWord(self.registers, MPU6050.MPU6050_RA_ACCEL_XOUT_H + 2 * i, value)
+
+		# zero-motion status, like the chip from the high passed accelerometer
+		# only, so rotation that leaves gravity where it is goes unnoticed
+		status = self.registers[MPU6050.MPU6050_RA_MOT_DETECT_STATUS] & ~(1 << MPU6050.MPU6050_MOTION_MOT_ZRMOT_BIT)
+		if max(abs(value) for value in self.highPassAccel(gravity, interval)) < self.getZeroMotionThreshold():
+			status |= 1 << MPU6050.MPU6050_MOTION_MOT_ZRMOT_BIT
+		self.registers[MPU6050.MPU6050_RA_MOT_DETECT_STATUS] = status
+
+	def highPassAccel(self, accel, interval):
+		# First order high pass at the ACCEL_HPF cutoff in bits 2:0 of
+		# ACCEL_CONFIG, in g. Reset and hold are taken as no output.
+		cutoff = self.DHPF_CUTOFFS.get(self.registers[MPU6050.MPU6050_RA_ACCEL_CONFIG] & 0x07)
+		if cutoff is None or self.accelLowPass is None:
+			self.accelLowPass = list(accel)
+			return [0, 0, 0]
+
+		k = min(1.0, 2 * math.pi * cutoff * interval)
+		self.accelLowPass = [low + k * (value - low) for value, low in zip(accel, self.accelLowPass)]
+		return [value - low for value, low in zip(accel, self.accelLowPass)]
+
+	def getZeroMotionThreshold(self):
+		# ZRMOT_THR in g, at 2mg per LSB
+		return self.registers[MPU6050.MPU6050_RA_ZRMOT_THR] * 0.002
+
+	def getGyroError(self):
+		# gyroBias less the user offsets, in deg/s per axis
+		errors = []
+		for axis, bias in enumerate(self.gyroBias):
+			reg = MPU6050.MPU6050_RA_XG_OFFS_USRH + 2 * axis
+			offset = (self.registers[reg] << 8) | self.registers[reg + 1]
+			if offset > 32767:
+				offset -= 65536
+			errors.append(bias + offset / MPU6050.MPU6050_GYRO_OFFSET_LSB_PER_DPS)
+		return errors
+
+if __name__ == "__main__":
+	# Benchmark the acquisition path against the simulated device
+	import GyroscopeHardware
+
+	sim = SimulatedMPU6050(motion = leanSweepMotion())
+	gyro = GyroscopeHardware.GyroscopeHardware(bus = sim)
+
+	duration = 2.0
+	updates = 0
+	startTransactions = sim.transactions
+	startTime = time.time()
+
+	while time.time() - startTime < duration:
+		gyro.update()
+		updates += 1
+
+	transactions = sim.transactions - startTransactions
+	print("%d updates, %.0f bus transactions per second, %.1f per update" % (updates, transactions / duration, float(transactions) / updates))
+	gyro.display()
@@ -0,0 +1,29 @@
+from collections import deque
+
+class SlidingWindowMax:
+	"""Maximum of the values added in the last window milliseconds.
+
+	Only values that can still become the maximum are kept, in decreasing
+	order, so add() and getMax() are amortized O(1) however many samples the
+	window holds."""
+
+	def __init__(self, window):
+		self.window = window
+
+		# GyroAxisData, values decreasing from the front, times increasing
+		self.buffer = deque()
+
+	def add(self, data, now):
+		# a newer value at least as big outlives the smaller ones before it
+		while self.buffer and self.buffer[-1].val <= data.val:
+			self.buffer.pop()
+		self.buffer.append(data)
+
+		self.expire(now)
+
+	def expire(self, now):
+		while self.buffer and now - self.buffer[0].time > self.window:
+			self.buffer.popleft()
+
+	def getMax(self):
+		return self.buffer[0].val if self.buffer else 0
@@ -1,4 +1,8 @@
-import RPi.GPIO as GPIO
+try:
+	import RPi.GPIO as GPIO
+except ImportError:
+	print "RPi.GPIO unavailable, the switch is simulated"
+	import SimulatedGPIO as GPIO
 
 class Switch:
 
@@ -2,14 +2,49 @@
 
 # Python Standard Library Imports
 from time import sleep
-from math import atan, atan2, sqrt
+from math import atan, atan2, asin, sqrt
+from hashlib import md5
+from struct import Struct
 
 # External Imports
-pass
+try:
+    import numpy
+except ImportError:
+    # only needed for the dmp...Batch decoders
+    numpy = None
 
 # Custom Imports
 from pycomms import PyComms
 
+class DMPSample(object):
+    # Values decoded from one DMP packet by MPU6050.dmpDecodePacket, which
+    # can refill the same object for every packet instead of allocating.
+    # Angles are in radians, rates in deg/s and accelerations in g.
+    __slots__ = ('w', 'x', 'y', 'z', 'gravityX', 'gravityY', 'gravityZ', 'yaw', 'pitch', 'roll',
+                 'gyroX', 'gyroY', 'gyroZ', 'accelX', 'accelY', 'accelZ',
+                 'linearAccelX', 'linearAccelY', 'linearAccelZ')
+
+    def __init__(self):
+        self.w = 1.0
+        self.x = 0.0
+        self.y = 0.0
+        self.z = 0.0
+        self.gravityX = 0.0
+        self.gravityY = 0.0
+        self.gravityZ = 1.0
+        self.yaw = 0.0
+        self.pitch = 0.0
+        self.roll = 0.0
+        self.gyroX = 0.0
+        self.gyroY = 0.0
+        self.gyroZ = 0.0
+        self.accelX = 0.0
+        self.accelY = 0.0
+        self.accelZ = 1.0
+        self.linearAccelX = 0.0
+        self.linearAccelY = 0.0
+        self.linearAccelZ = 0.0
+
 class MPU6050:
     # Register map based on Jeff Rowberg <jeff@rowberg.net> source code at
     # https://github.com/jrowberg/i2cdevlib/blob/master/Arduino/MPU6050/MPU6050.h
@@ -378,6 +413,13 @@ class MPU6050:
     MPU6050_DMP_CODE_SIZE         = 1929    # dmpMemory[]
     MPU6050_DMP_CONFIG_SIZE       = 192     # dmpConfig[]
     MPU6050_DMP_UPDATES_SIZE      = 47      # dmpUpdates[]
+    
+    # banks 0-2 hold DMP data that changes while it runs, the program starts at bank 3
+    MPU6050_DMP_PROGRAM_START     = 0x300
+    
+    # D_0_22, 16-bit DMP FIFO rate divider (see the last dmpConfig entry)
+    MPU6050_DMP_FIFO_RATE_BANK    = 0x02
+    MPU6050_DMP_FIFO_RATE_ADDRESS = 0x16
     # ====================================================================================================
     # | Default MotionApps v2.0 42-byte FIFO packet structure:                                           |
     # |                                                                                                  |
@@ -583,17 +625,117 @@ class MPU6050:
     # Setting up internal 42-byte (default) DMP packet buffer
     dmpPacketSize = 42
     
+    # signed 16-bit upper words of the four quaternion fields
+    dmpQuaternionStruct = Struct('>h2xh2xh2xh2x')
+    
+    # signed 16-bit upper words of the quaternion, gyro and accel fields
+    dmpPacketStruct = Struct('>h2xh2xh2xh2xh2xh2xh2xh2xh2xh2x')
+    
+    # sensor register scaling: LSB per g / per deg/s at full scale range 0 (2 g / 250 deg/s),
+    # halving with every step up in range
+    MPU6050_ACCEL_LSB_PER_G       = 16384.0
+    MPU6050_GYRO_LSB_PER_DPS      = 131.0
+    
+    # gyro user offset registers, the same at every full scale range
+    MPU6050_GYRO_OFFSET_LSB_PER_DPS = 32.8
+    
+    # accel x/y/z, temperature and gyro x/y/z from ACCEL_XOUT_H, temperature skipped
+    motion6Struct = Struct('>hhh2xhhh')
+    vectorStruct = Struct('>hhh')
+    
+    # DMP packet scaling: quaternion 1.0, accel 1 g, gyro 1 deg/s (at +/- 2000 deg/s)
+    MPU6050_DMP_QUATERNION_SCALE  = 16384.0
+    MPU6050_DMP_ACCEL_SCALE       = 8192.0
+    MPU6050_DMP_GYRO_SCALE        = 16.4
+    
+    # SMPLRT_DIV the DMP firmware integrates at, 200 Hz. It must not be changed
+    # while the DMP runs, slow the output down with dmpSetFIFORateDivider.
+    MPU6050_DMP_SAMPLE_RATE       = 4
+    
+    # digest of the DMP program as it should look once loaded, see dmpGetProgramDigest()
+    dmpProgramDigest = None
+    
     # construct a new object with the I2C address of the MPU6050
-    def __init__(self, address = MPU6050_DEFAULT_ADDRESS):
-        self.i2c = PyComms(address)
+    def __init__(self, address = MPU6050_DEFAULT_ADDRESS, bus = None, rawBusNumber = None):
+        # with rawBusNumber, /dev/i2c-N is opened to read the FIFO in one
+        # transfer instead of blocks of 32 bytes
+        self.i2c = PyComms(address, bus, rawBusNumber)
         self.address = address
         
+        # (quaternion, matrix, batch matrices) turning the sensor's axes to the
+        # bike's, see setMountingQuaternion. Replaced as a whole so the
+        # sampling thread never sees half of an update.
+        self.mounting = None
+        
+    def setMountingQuaternion(self, q):
+        # Decoded packets are turned from the sensor's axes to the bike's by
+        # q (w, x, y, z), None for a sensor mounted square. The DMP quaternion
+        # is multiplied by q on the right, gyro and accel are rotated with the
+        # matching matrix. See Calibration for working q out.
+        self.mounting = getMounting(q)
+        
+    def getMountingQuaternion(self):
+        if self.mounting is None:
+            return None
+        return self.mounting[0]
+        
+    def enableRegisterShadow(self):
+        # Lets setters skip the read of their read-modify-write cycle. Status,
+        # FIFO and memory access registers are changed by the chip itself and
+        # always go to the bus, reset bits are cleared by the chip once done.
+        volatileRegisters = [
+            self.MPU6050_RA_I2C_MST_STATUS,
+            self.MPU6050_RA_DMP_INT_STATUS,
+            self.MPU6050_RA_INT_STATUS,
+            self.MPU6050_RA_MOT_DETECT_STATUS,
+            self.MPU6050_RA_MEM_START_ADDR,
+            self.MPU6050_RA_MEM_R_W,
+            self.MPU6050_RA_FIFO_COUNTH,
+            self.MPU6050_RA_FIFO_COUNTL,
+            self.MPU6050_RA_FIFO_R_W]
+        
+        selfClearingBits = {
+            self.MPU6050_RA_SIGNAL_PATH_RESET : (1 << self.MPU6050_PATHRESET_GYRO_RESET_BIT) |
+                                                (1 << self.MPU6050_PATHRESET_ACCEL_RESET_BIT) |
+                                                (1 << self.MPU6050_PATHRESET_TEMP_RESET_BIT),
+            self.MPU6050_RA_USER_CTRL : (1 << self.MPU6050_USERCTRL_DMP_RESET_BIT) |
+                                        (1 << self.MPU6050_USERCTRL_FIFO_RESET_BIT) |
+                                        (1 << self.MPU6050_USERCTRL_I2C_MST_RESET_BIT) |
+                                        (1 << self.MPU6050_USERCTRL_SIG_COND_RESET_BIT),
+            self.MPU6050_RA_PWR_MGMT_1 : (1 << self.MPU6050_PWR1_DEVICE_RESET_BIT)}
+        
+        self.i2c.enableShadow(volatileRegisters, selfClearingBits)
+        
     def initialize(self):
         self.setClockSource(self.MPU6050_CLOCK_PLL_XGYRO)
         self.setFullScaleGyroRange(self.MPU6050_GYRO_FS_250)
         self.setFullScaleAccelRange(self.MPU6050_ACCEL_FS_2)   
         self.setSleepEnabled(False)
         
+    def rawInitialize(self, rate = 0, dlpfMode = MPU6050_DLPF_BW_42, gyroRange = MPU6050_GYRO_FS_1000, accelRange = MPU6050_ACCEL_FS_4):
+        # Sets the chip up for reading the sensors directly (getMotion6) instead
+        # of through the DMP, no firmware upload needed.
+        # Sample rate is 1kHz / (1 + rate) with the DLPF on.
+        self.reset()
+        sleep(0.05) # wait after reset
+        
+        self.setSleepEnabled(False)
+        self.setClockSource(self.MPU6050_CLOCK_PLL_XGYRO)
+        self.setDLPFMode(dlpfMode)
+        self.setRate(rate)
+        self.setFullScaleGyroRange(gyroRange)
+        self.setFullScaleAccelRange(accelRange)
+        
+        # Data ready interrupt only
+        self.setIntEnabled(1 << self.MPU6050_INTERRUPT_DATA_RDY_BIT)
+        
+        self.setRawScale(gyroRange, accelRange)
+        
+    def setRawScale(self, gyroRange, accelRange):
+        # LSB per deg/s and per g for getMotion6Scaled
+        self.gyroScale = self.MPU6050_GYRO_LSB_PER_DPS / (1 << gyroRange)
+        self.accelScale = self.MPU6050_ACCEL_LSB_PER_G / (1 << accelRange)
+        
     def testConnection(self):
         return self.getDeviceID() == 0x34
     
@@ -654,7 +796,7 @@ class MPU6050:
     def getDHPFMode(self):
         return self.i2c.readBits(self.MPU6050_RA_ACCEL_CONFIG, self.MPU6050_ACONFIG_ACCEL_HPF_BIT, self.MPU6050_ACONFIG_ACCEL_HPF_LENGTH)
 
-    def setDHPFMode(self, bandwith):
+    def setDHPFMode(self, bandwidth):
         self.i2c.writeBits(self.MPU6050_RA_ACCEL_CONFIG, self.MPU6050_ACONFIG_ACCEL_HPF_BIT, self.MPU6050_ACONFIG_ACCEL_HPF_LENGTH, bandwidth)
 
     def getFreefallDetectionThreshold(self):
@@ -1028,34 +1170,59 @@ class MPU6050:
         pass
 
     def getMotion6(self):
-        pass
+        # (ax, ay, az, gx, gy, gz) raw, all read in one 14 byte burst so they
+        # belong to the same sample
+        data = self.i2c.readBytesListU(self.MPU6050_RA_ACCEL_XOUT_H, 14)
+        if data == -1:
+            return -1
+        
+        return self.motion6Struct.unpack(bytes(bytearray(data)))
+        
+    def getMotion6Scaled(self):
+        # (ax, ay, az) in g and (gx, gy, gz) in deg/s, see rawInitialize
+        motion = self.getMotion6()
+        if motion == -1:
+            return -1
+        
+        ax, ay, az, gx, gy, gz = motion
+        return (ax / self.accelScale, ay / self.accelScale, az / self.accelScale,
+                gx / self.gyroScale, gy / self.gyroScale, gz / self.gyroScale)
 
     def getAcceleration(self):
-        pass
+        data = self.i2c.readBytesListU(self.MPU6050_RA_ACCEL_XOUT_H, 6)
+        if data == -1:
+            return -1
+        
+        return self.vectorStruct.unpack(bytes(bytearray(data)))
         
     def getAccelerationX(self):
-        pass
+        return self.i2c.readS16(self.MPU6050_RA_ACCEL_XOUT_H)
         
     def getAccelerationY(self):
-        pass
+        return self.i2c.readS16(self.MPU6050_RA_ACCEL_YOUT_H)
         
     def getAccelerationZ(self):
-        pass
+        return self.i2c.readS16(self.MPU6050_RA_ACCEL_ZOUT_H)
         
     def getTemperature(self):
-        pass
+        # raw, degrees C = value / 340 + 36.53
+        return self.i2c.readS16(self.MPU6050_RA_TEMP_OUT_H)
         
     def getRotation(self):
-        pass
+        data = self.i2c.readBytesListU(self.MPU6050_RA_GYRO_XOUT_H, 6)
+        if data == -1:
+            return -1
+        
+        return self.vectorStruct.unpack(bytes(bytearray(data)))
         
     def getRotationX(self):
-        pass
+        return self.i2c.readS16(self.MPU6050_RA_GYRO_XOUT_H)
         
     def getRotationY(self):
-        pass
+        return self.i2c.readS16(self.MPU6050_RA_GYRO_YOUT_H)
      
     def getRotationZ(self):
-        pass
+        return self.i2c.readS16(self.MPU6050_RA_GYRO_ZOUT_H)
       
     def getExternalSensorByte(self, position):
         return self.i2c.readU8(self.MPU6050_RA_EXT_SENS_DATA_00 + position)
@@ -1161,6 +1328,8 @@ class MPU6050:
         
     def reset(self):
         self.i2c.writeBit(self.MPU6050_RA_PWR_MGMT_1, self.MPU6050_PWR1_DEVICE_RESET_BIT, True)       
+        # every register is back at its default now
+        self.i2c.invalidateShadow()
         
     def getSleepEnabled(self):
         return self.i2c.readBit(self.MPU6050_RA_PWR_MGMT_1, self.MPU6050_PWR1_SLEEP_BIT)
@@ -1310,28 +1479,43 @@ class MPU6050:
         pass
 
     def getXGyroOffsetUser(self):
-        pass
+        return self.i2c.readS16(self.MPU6050_RA_XG_OFFS_USRH)
         
     def setXGyroOffsetUser(self, value):
-        self.i2c.write8(self.MPU6050_RA_XG_OFFS_USRH, value >> 8)
+        self.i2c.write8(self.MPU6050_RA_XG_OFFS_USRH, (value >> 8) & 0xFF)
         self.i2c.write8(self.MPU6050_RA_XG_OFFS_USRL, value & 0xFF) 
         return True        
         
     def getYGyroOffsetUser(self):
-        pass
+        return self.i2c.readS16(self.MPU6050_RA_YG_OFFS_USRH)
         
     def setYGyroOffsetUser(self, value):
-        self.i2c.write8(self.MPU6050_RA_YG_OFFS_USRH, value >> 8)
+        self.i2c.write8(self.MPU6050_RA_YG_OFFS_USRH, (value >> 8) & 0xFF)
         self.i2c.write8(self.MPU6050_RA_YG_OFFS_USRL, value & 0xFF) 
         return True        
         
     def getZGyroOffsetUser(self):
-        pass
+        return self.i2c.readS16(self.MPU6050_RA_ZG_OFFS_USRH)
         
     def setZGyroOffsetUser(self, value):
-        self.i2c.write8(self.MPU6050_RA_ZG_OFFS_USRH, value >> 8)
+        self.i2c.write8(self.MPU6050_RA_ZG_OFFS_USRH, (value >> 8) & 0xFF)
         self.i2c.write8(self.MPU6050_RA_ZG_OFFS_USRL, value & 0xFF) 
         return True        
+        
+    def getGyroOffsetUser(self):
+        # x, y, z user offsets in one burst read. They are added to the gyro
+        # readings before the DMP sees them, MPU6050_GYRO_OFFSET_LSB_PER_DPS
+        # whatever the full scale range.
+        data = self.i2c.readBytesListU(self.MPU6050_RA_XG_OFFS_USRH, 6)
+        if data == -1:
+            return -1
+        
+        return self.vectorStruct.unpack(bytes(bytearray(data)))
+        
+    def setGyroOffsetUser(self, x, y, z):
+        # All three user offsets in one burst write
+        self.i2c.writeList(self.MPU6050_RA_XG_OFFS_USRH, list(bytearray(self.vectorStruct.pack(x, y, z))))
+        return True
 
     def getIntPLLReadyEnabled(self):
         return self.i2c.readBit(self.MPU6050_RA_INT_ENABLE, self.MPU6050_INTERRUPT_PLL_RDY_INT_BIT)
@@ -1399,41 +1583,68 @@ class MPU6050:
     def writeMemoryByte(self, data):
         self.i2c.write8(self.MPU6050_RA_MEM_R_W, data)
 
-    def readMemoryBlock(self):
-        pass
+    def readMemoryBlock(self, dataSize, bank = 0, address = 0):
+        # read DMP memory in chunks, only switching bank on 256-byte boundaries
+        self.setMemoryBank(bank)
+        
+        data = []
+        while len(data) < dataSize:
+            chunkSize = self.getMemoryChunkSize(dataSize - len(data), address)
+            
+            self.setMemoryStartAddress(address)
+            chunk = self.i2c.readBytes(self.MPU6050_RA_MEM_R_W, chunkSize)
+            if chunk == -1:
+                return -1
+            data.extend(chunk)
+            
+            address += chunkSize
+            if address == self.MPU6050_DMP_MEMORY_BANK_SIZE and len(data) < dataSize:
+                address = 0
+                bank += 1
+                self.setMemoryBank(bank)
+                
+        return data
+
+    def getMemoryChunkSize(self, remaining, address):
+        # a chunk never runs past the end of the data or the current bank
+        return min(self.MPU6050_DMP_MEMORY_CHUNK_SIZE, remaining, self.MPU6050_DMP_MEMORY_BANK_SIZE - address)
 
     def writeMemoryBlock(self, data, dataSize, bank = 0, address = 0, verify = False):
+        # write DMP memory in chunks, only switching bank on 256-byte boundaries
         self.setMemoryBank(bank)
-        self.setMemoryStartAddress(address)
         
+        success = True
         i = 0
-        while i < dataSize:  
-            self.i2c.write8(self.MPU6050_RA_MEM_R_W, data[i])
+        while i < dataSize:
+            chunkSize = self.getMemoryChunkSize(dataSize - i, address)
+            chunk = list(data[i:i + chunkSize])
+            
+            self.setMemoryStartAddress(address)
+            self.i2c.writeList(self.MPU6050_RA_MEM_R_W, chunk)
 
             # Verify
             if verify:
-                self.setMemoryBank(bank)
                 self.setMemoryStartAddress(address)
-                result = self.i2c.readU8(self.MPU6050_RA_MEM_R_W)
+                result = self.i2c.readBytes(self.MPU6050_RA_MEM_R_W, chunkSize)
                 
-                if result != data[i]:
-                    print(data[i]),
+                if result != chunk:
+                    print(chunk),
                     print(result),
                     print(address)
+                    success = False
                     
+            # increase byte index
+            i += chunkSize
+            
             # reset adress to 0 after reaching 255
-            if address == 255:
+            address += chunkSize
+            if address == self.MPU6050_DMP_MEMORY_BANK_SIZE and i < dataSize:
                 address = 0
                 bank += 1
 
                 self.setMemoryBank(bank)
-            else:
-                address += 1
-            
-            self.setMemoryStartAddress(address)
 
-            # increase byte index
-            i += 1
+        return success
 
 
     def writeDMPConfigurationSet(self, data, dataSize, bank = 0, address = 0, verify = False):
@@ -1485,39 +1696,81 @@ class MPU6050:
     def dmpGetFIFOPacketSize(self):
         return self.dmpPacketSize    
     
-    def dmpGetAccel(self):
-        pass
+    def dmpGetFIFORate(self):
+        # packets per second: sample rate (1kHz / (1 + SMPLRT_DIV)) / (1 + D_0_22)
+        return 1000.0 / (1 + self.getRate()) / (1 + self.dmpGetFIFORateDivider())
     
-    def dmpGetQuaternion(self, packet):
-        # We are dealing with signed bytes
-        if packet[0] > 127:
-            packet[0] -= 256
-
-        if packet[4] > 127:
-            packet[4] -= 256
+    def dmpGetFIFORateDivider(self):
+        divider = self.readMemoryBlock(2, self.MPU6050_DMP_FIFO_RATE_BANK, self.MPU6050_DMP_FIFO_RATE_ADDRESS)
+        self.setMemoryBank(0, False, False)
+        if divider == -1:
+            return 0
             
-        if packet[8] > 127:
-            packet[8] -= 256            
-          
-        if packet[12] > 127:
-            packet[12] -= 256          
+        return (divider[0] << 8) | divider[1]
+    
+    def dmpSetFIFORateDivider(self, divider):
+        # The DMP outputs one packet every 1 + divider samples, dmpConfig sets 5.
+        # Can be changed while the DMP runs, reset the FIFO afterwards.
+        success = self.writeMemoryBlock([divider >> 8, divider & 0xFF], 2, self.MPU6050_DMP_FIFO_RATE_BANK, self.MPU6050_DMP_FIFO_RATE_ADDRESS, True)
+        self.setMemoryBank(0, False, False)
+        return success
+    
+    def dmpGetAccel(self, packet):
+        # raw accelerometer, MPU6050_DMP_ACCEL_SCALE per g
+        x, y, z = self.dmpPacketStruct.unpack_from(bytearray(packet[:40]))[7:10]
+        
+        data = {
+            'x' : x,
+            'y' : y,
+            'z' : z}
+        
+        return data
+    
+    def dmpGetQuaternion(self, packet):
+        # We are dealing with signed words, the packet is left untouched
+        w, x, y, z = self.dmpQuaternionStruct.unpack_from(bytearray(packet[:16]))
 
         data = {
-            'w' : ((packet[0] << 8) + packet[1]) / 16384.0,  
-            'x' : ((packet[4] << 8) + packet[5]) / 16384.0,
-            'y' : ((packet[8] << 8) + packet[9]) / 16384.0,
-            'z' : ((packet[12] << 8) + packet[13]) / 16384.0}        
+            'w' : w / 16384.0,  
+            'x' : x / 16384.0,
+            'y' : y / 16384.0,
+            'z' : z / 16384.0}        
         
         return data    
     
-    def dmpGetGyro(self):
-        pass
+    def dmpGetGyro(self, packet):
+        # raw gyro, MPU6050_DMP_GYRO_SCALE per deg/s
+        x, y, z = self.dmpPacketStruct.unpack_from(bytearray(packet[:40]))[4:7]
+        
+        data = {
+            'x' : x,
+            'y' : y,
+            'z' : z}
+        
+        return data
     
-    def dmpGetLinearAccel(self):
-        pass
+    def dmpGetLinearAccel(self, a, g):
+        # raw accel with gravity removed
+        data = {
+            'x' : a['x'] - g['x'] * self.MPU6050_DMP_ACCEL_SCALE,
+            'y' : a['y'] - g['y'] * self.MPU6050_DMP_ACCEL_SCALE,
+            'z' : a['z'] - g['z'] * self.MPU6050_DMP_ACCEL_SCALE}
+        
+        return data
     
-    def dmpGetLinearAccelInWorld(self):
-        pass
+    def dmpGetLinearAccelInWorld(self, a, q):
+        # rotate the linear accel from sensor to world frame: q * a * conj(q)
+        w = -q['x'] * a['x'] - q['y'] * a['y'] - q['z'] * a['z']
+        x = q['w'] * a['x'] + q['y'] * a['z'] - q['z'] * a['y']
+        y = q['w'] * a['y'] - q['x'] * a['z'] + q['z'] * a['x']
+        z = q['w'] * a['z'] + q['x'] * a['y'] - q['y'] * a['x']
+        
+        data = {
+            'x' : -w * q['x'] + x * q['w'] - y * q['z'] + z * q['y'],
+            'y' : -w * q['y'] + x * q['z'] + y * q['w'] - z * q['x'],
+            'z' : -w * q['z'] - x * q['y'] + y * q['x'] + z * q['w']}
+        
+        return data
         
     def dmpGetGravity(self, q):
         data = {
@@ -1528,7 +1781,15 @@ class MPU6050:
         return data 
 
     def dmpGetEuler(self, q):
-        pass 
+        data = {
+            # psi
+            'psi' : atan2(2 * q['x'] * q['y'] - 2 * q['w'] * q['z'], 2 * q['w'] * q['w'] + 2 * q['x'] * q['x'] - 1),
+            # theta
+            'theta' : -asin(max(-1.0, min(1.0, 2 * q['x'] * q['z'] + 2 * q['w'] * q['y']))),
+            # phi
+            'phi' : atan2(2 * q['y'] * q['z'] - 2 * q['w'] * q['x'], 2 * q['w'] * q['w'] + 2 * q['z'] * q['z'] - 1)}
+        
+        return data 
 
     def dmpGetYawPitchRoll(self, q, g):
         data = {
@@ -1541,13 +1802,152 @@ class MPU6050:
             
         return data 
 
-    def dmpProcessFIFOPacket(self):
-        pass
+    # Batch decoders, see the module functions of the same name. These apply
+    # the mounting set with setMountingQuaternion.
+    
+    def dmpGetQuaternionBatch(self, data):
+        return dmpGetQuaternionBatch(data, self.mounting)
+
+    def dmpGetGravityBatch(self, q):
+        return dmpGetGravityBatch(q)
+
+    def dmpGetGyroBatch(self, data):
+        return dmpGetGyroBatch(data, self.mounting)
+
+    def dmpGetAccelBatch(self, data):
+        return dmpGetAccelBatch(data, self.mounting)
+
+    def dmpGetLinearAccelBatch(self, a, g):
+        return dmpGetLinearAccelBatch(a, g)
+
+    def dmpGetYawPitchRollBatch(self, q, g):
+        return dmpGetYawPitchRollBatch(q, g)
+
+    def dmpDecodePacket(self, packet, sample = None, offset = 0):
+        # Every field of a packet in one pass without building dicts:
+        # quaternion, gravity, yaw/pitch/roll, gyro, accel and linear accel.
+        # packet is a bytearray, bytes or list, offset is where the packet
+        # starts within it. Pass a DMPSample to have it refilled instead of a
+        # new one created.
+        if sample is None:
+            sample = DMPSample()
+        if isinstance(packet, list):
+            packet = bytearray(packet)
+            
+        w, x, y, z, gyroX, gyroY, gyroZ, accelX, accelY, accelZ = self.dmpPacketStruct.unpack_from(packet, offset)
+        w /= self.MPU6050_DMP_QUATERNION_SCALE
+        x /= self.MPU6050_DMP_QUATERNION_SCALE
+        y /= self.MPU6050_DMP_QUATERNION_SCALE
+        z /= self.MPU6050_DMP_QUATERNION_SCALE
+        
+        mounting = self.mounting
+        if mounting is not None:
+            (mw, mx, my, mz), ((m00, m01, m02), (m10, m11, m12), (m20, m21, m22)), batch = mounting
+            w, x, y, z = (w * mw - x * mx - y * my - z * mz,
+                          w * mx + x * mw + y * mz - z * my,
+                          w * my - x * mz + y * mw + z * mx,
+                          w * mz + x * my - y * mx + z * mw)
+            
+            gyroX, gyroY, gyroZ = (m00 * gyroX + m01 * gyroY + m02 * gyroZ,
+                                   m10 * gyroX + m11 * gyroY + m12 * gyroZ,
+                                   m20 * gyroX + m21 * gyroY + m22 * gyroZ)
+            accelX, accelY, accelZ = (m00 * accelX + m01 * accelY + m02 * accelZ,
+                                      m10 * accelX + m11 * accelY + m12 * accelZ,
+                                      m20 * accelX + m21 * accelY + m22 * accelZ)
+        
+        gx = 2 * (x * z - w * y)
+        gy = 2 * (w * x + y * z)
+        gz = w * w - x * x - y * y + z * z
+        
+        sample.w = w
+        sample.x = x
+        sample.y = y
+        sample.z = z
+        sample.gravityX = gx
+        sample.gravityY = gy
+        sample.gravityZ = gz
+        sample.yaw = atan2(2 * x * y - 2 * w * z, 2 * w * w + 2 * x * x - 1)
+        sample.pitch = atan(gx / sqrt(gy * gy + gz * gz))
+        sample.roll = atan(gy / sqrt(gx * gx + gz * gz))
+        
+        sample.gyroX = gyroX / self.MPU6050_DMP_GYRO_SCALE
+        sample.gyroY = gyroY / self.MPU6050_DMP_GYRO_SCALE
+        sample.gyroZ = gyroZ / self.MPU6050_DMP_GYRO_SCALE
+        sample.accelX = accelX / self.MPU6050_DMP_ACCEL_SCALE
+        sample.accelY = accelY / self.MPU6050_DMP_ACCEL_SCALE
+        sample.accelZ = accelZ / self.MPU6050_DMP_ACCEL_SCALE
+        sample.linearAccelX = sample.accelX - gx
+        sample.linearAccelY = sample.accelY - gy
+        sample.linearAccelZ = sample.accelZ - gz
+        
+        return sample
+
+    def dmpProcessFIFOPacket(self, packet, sample = None):
+        return self.dmpDecodePacket(packet, sample)
+        
+    def dmpReadAndProcessFIFOPacket(self, sample = None):
+        # Reads and decodes the next packet, None when the FIFO has none
+        if not self.dmpPacketAvailable():
+            return None
+        
+        packet = self.getFIFOBytes(self.dmpPacketSize)
+        if packet == -1:
+            return None
+        
+        return self.dmpDecodePacket(packet, sample)
+
+    def dmpGetProgramDigest(self):
+        # The DMP program is dmpMemory with the dmpConfig blocks that patch it
+        # applied, computed once and shared by every instance
+        if MPU6050.dmpProgramDigest is None:
+            image = list(self.dmpMemory)
+            
+            pos = 0
+            while pos < self.MPU6050_DMP_CONFIG_SIZE:
+                bank, offset, length = self.dmpConfig[pos:pos + 3]
+                if length > 0:
+                    start = bank * self.MPU6050_DMP_MEMORY_BANK_SIZE + offset
+                    image[start:start + length] = self.dmpConfig[pos + 3:pos + 3 + length]
+                    pos += 3 + length
+                else:
+                    # special instruction, carries a single byte
+                    pos += 4
+            
+            program = image[self.MPU6050_DMP_PROGRAM_START:self.MPU6050_DMP_CODE_SIZE]
+            MPU6050.dmpProgramDigest = md5(bytearray(program)).digest()
+            
+        return MPU6050.dmpProgramDigest
+
+    def dmpIsProgramLoaded(self):
+        # Bulk reads the resident DMP program and compares it with the expected image
+        bank = self.MPU6050_DMP_PROGRAM_START // self.MPU6050_DMP_MEMORY_BANK_SIZE
+        program = self.readMemoryBlock(self.MPU6050_DMP_CODE_SIZE - self.MPU6050_DMP_PROGRAM_START, bank, 0)
+        self.setMemoryBank(0, False, False)
+        
+        if program == -1:
+            return False
+        
+        return md5(bytearray(program)).digest() == self.dmpGetProgramDigest()
+
+    def dmpWarmStart(self):
+        # dmpInitialize without the program upload, when the DMP program is
+        # still in memory from a previous run (the chip keeps it until it loses
+        # power). The registers are set up again all the same: a reset, or a
+        # run that stopped halfway through dmpInitialize, leaves the memory
+        # as it was but not the registers.
+        # Returns False when a full dmpInitialize is needed.
+        self.setSleepEnabled(False)
         
-    def dmpReadAndProcessFIFOPacket(self):
-        pass
+        # Stop the DMP while its memory is read back
+        self.setDMPEnabled(False)
+        
+        if not self.dmpIsProgramLoaded():
+            return False
+        
+        self.dmpInitialize(uploadProgram = False)
+        return True
 
-    def dmpInitialize(self):
+    def dmpInitialize(self, uploadProgram = True):
         # Resetting MPU6050
         self.reset()
         sleep(0.05) # wait after reset
@@ -1571,11 +1971,13 @@ class MPU6050:
         # Enable pass through mode
         self.setI2CBypassEnabled(True)
         
-        # load DMP code into memory banks
-        self.writeMemoryBlock(self.dmpMemory, self.MPU6050_DMP_CODE_SIZE, 0, 0, False)
-        #print('Success! DMP code written and verified')
+        # load DMP code into memory banks, see dmpWarmStart
+        if uploadProgram:
+            self.writeMemoryBlock(self.dmpMemory, self.MPU6050_DMP_CODE_SIZE, 0, 0, False)
+            #print('Success! DMP code written and verified')
         
-        # write DMP configuration
+        # write DMP configuration, a few hundred bytes, always written as a run
+        # stopped partway through may have left it half done
         self.writeDMPConfigurationSet(self.dmpConfig, self.MPU6050_DMP_CONFIG_SIZE, 0, 0, False)
         #print('Success! DMP configuration written and verified')
         
@@ -1586,7 +1988,7 @@ class MPU6050:
         self.setIntEnabled(0x12)
         
         # Setting sample rate to 200Hz
-        self.setRate(4) # 1khz / (1 + 4) = 200 Hz [9 = 100 Hz]
+        self.setRate(self.MPU6050_DMP_SAMPLE_RATE) # 1khz / (1 + 4) = 200 Hz
         
         # Setting external frame sync to TEMP_OUT_L[0]
         self.setExternalFrameSync(self.MPU6050_EXT_SYNC_TEMP_OUT_L)
@@ -1733,4 +2135,87 @@ class MPU6050:
         
         # Resetting FIFO and clearing INT status one last time
         self.resetFIFO()
-        self.getIntStatus()
\ No newline at end of file
+        self.getIntStatus()
+
+# Packet decoding that needs no device, for recorded packets (see
+# SessionAnalysis). The batch decoders take a buffer of N consecutive DMP
+# packets and need numpy.
+
+def getMounting(q):
+    # (quaternion, matrix, batch matrices) for a mounting quaternion q
+    # (w, x, y, z), None for None. See MPU6050.setMountingQuaternion.
+    if q is None:
+        return None
+    
+    w, x, y, z = q
+    matrix = (
+        (1 - 2 * (y * y + z * z), 2 * (x * y + w * z), 2 * (x * z - w * y)),
+        (2 * (x * y - w * z), 1 - 2 * (x * x + z * z), 2 * (y * z + w * x)),
+        (2 * (x * z + w * y), 2 * (y * z - w * x), 1 - 2 * (x * x + y * y)))
+    
+    # The batch decoders apply the mounting with one matrix product per
+    # buffer, fused with the scaling of the raw words: rows of packet
+    # words times these give mounted quaternions, gyro and accel
+    batch = None
+    if numpy is not None:
+        rightMultiply = numpy.array((
+            (w, x, y, z),
+            (-x, w, -z, y),
+            (-y, z, w, -x),
+            (-z, -y, x, w)))
+        vectorMatrix = numpy.array(matrix).T
+        batch = (rightMultiply / MPU6050.MPU6050_DMP_QUATERNION_SCALE,
+                 vectorMatrix / MPU6050.MPU6050_DMP_GYRO_SCALE,
+                 vectorMatrix / MPU6050.MPU6050_DMP_ACCEL_SCALE)
+    
+    return ((w, x, y, z), matrix, batch)
+
+def dmpGetPacketWords(data):
+    # (N, 21) array of the big-endian int16 words of each packet
+    return numpy.frombuffer(bytearray(data), dtype = '>i2').reshape(-1, MPU6050.dmpPacketSize // 2)
+
+def dmpGetQuaternionBatch(data, mounting = None):
+    # (N, 4) array of w, x, y, z. The quaternion is the upper word of the
+    # first four 32-bit fields. mounting is from getMounting.
+    packets = dmpGetPacketWords(data)
+    if mounting is not None:
+        return packets[:, 0:8:2].dot(mounting[2][0])
+    return packets[:, 0:8:2] / MPU6050.MPU6050_DMP_QUATERNION_SCALE
+
+def dmpGetGravityBatch(q):
+    # (N, 4) quaternions to an (N, 3) array of x, y, z, see MPU6050.dmpGetGravity
+    w, x, y, z = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+    
+    return numpy.column_stack((
+        2 * (x * z - w * y),
+        2 * (w * x + y * z),
+        w * w - x * x - y * y + z * z))
+
+def dmpGetGyroBatch(data, mounting = None):
+    # (N, 3) array of gyro x, y, z in deg/s
+    packets = dmpGetPacketWords(data)
+    if mounting is not None:
+        return packets[:, 8:14:2].dot(mounting[2][1])
+    return packets[:, 8:14:2] / MPU6050.MPU6050_DMP_GYRO_SCALE
+
+def dmpGetAccelBatch(data, mounting = None):
+    # (N, 3) array of accel x, y, z in g
+    packets = dmpGetPacketWords(data)
+    if mounting is not None:
+        return packets[:, 14:20:2].dot(mounting[2][2])
+    return packets[:, 14:20:2] / MPU6050.MPU6050_DMP_ACCEL_SCALE
+
+def dmpGetLinearAccelBatch(a, g):
+    # (N, 3) accel in g with the (N, 3) gravity removed
+    return a - g
+
+def dmpGetYawPitchRollBatch(q, g):
+    # (N, 4) quaternions and (N, 3) gravity to an (N, 3) array of yaw,
+    # pitch, roll in radians, see MPU6050.dmpGetYawPitchRoll
+    w, x, y, z = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+    gx, gy, gz = g[:, 0], g[:, 1], g[:, 2]
+    
+    return numpy.column_stack((
+        numpy.arctan2(2 * x * y - 2 * w * z, 2 * w * w + 2 * x * x - 1),
+        numpy.arctan(gx / numpy.sqrt(gy * gy + gz * gz)),
+        numpy.arctan(gy / numpy.sqrt(gx * gx + gz * gz))))
@@ -1,23 +1,99 @@
 #!/usr/bin/python
 
 # Python Standard Library Imports
-import smbus
+import os
 
 # External Imports
-pass
+try:
+    import smbus
+except ImportError:
+    # only needed for the real bus, see PyComms for the alternatives
+    smbus = None
 
 # Custom Imports
 pass
 
+# The Pi's I2C bus, opened the first time a PyComms is created without a bus
+defaultBus = None
+
+def getDefaultBus():
+    global defaultBus
+
+    if defaultBus is None:
+        if smbus is None:
+            raise ImportError("smbus is not installed, pass a bus to PyComms instead")
+        defaultBus = smbus.SMBus(1)
+
+    return defaultBus
+
 # ===========================================================================
 # PyComms I2C Base Class (an rewriten Adafruit_I2C pythone class clone)
 # ===========================================================================
 
 class PyComms:
-    def __init__(self, address, bus = smbus.SMBus(1)):
+    # The bus is an smbus.SMBus or any object with the subset of its methods
+    # used here, like SimulatedMPU6050: read_byte_data(address, reg),
+    # write_byte_data(address, reg, value), read_i2c_block_data(address, reg,
+    # length) and write_i2c_block_data(address, reg, data).
+
+    # SMBus block transfers are limited to 32 bytes
+    MAX_BLOCK_LENGTH = 32
+
+    # ioctl request to select the slave address on /dev/i2c-N
+    I2C_SLAVE = 0x0703
+
+    def __init__(self, address, bus = None, rawBusNumber = None):
+        if bus is None:
+            bus = getDefaultBus()
+
         self.address = address
         self.bus = bus
 
+        self.rawDevice = None
+        if rawBusNumber is not None:
+            self.openRawDevice(rawBusNumber)
+
+        # Register shadow, disabled until enableShadow() is called
+        self.shadow = None
+        self.volatileRegisters = frozenset()
+        self.selfClearingBits = {}
+
+    def enableShadow(self, volatileRegisters = (), selfClearingBits = {}):
+        # Remembers the last value written to each register so read-modify-write
+        # bit operations only need the write. volatileRegisters are changed by
+        # the device itself and are never shadowed, selfClearingBits maps a
+        # register to the mask of bits the device clears after they are set.
+        self.shadow = {}
+        self.volatileRegisters = frozenset(volatileRegisters)
+        self.selfClearingBits = dict(selfClearingBits)
+
+    def disableShadow(self):
+        self.shadow = None
+
+    def invalidateShadow(self, reg = None):
+        # Forgets one register, or every register (e.g. after a device reset)
+        if self.shadow is None:
+            return
+        if reg is None:
+            self.shadow.clear()
+        else:
+            self.shadow.pop(reg, None)
+
+    def readShadowed(self, reg):
+        # Reads a register for a read-modify-write, from the shadow if possible
+        if self.shadow is not None and reg in self.shadow:
+            return self.shadow[reg]
+
+        b = self.readU8(reg)
+        if self.shadow is not None and b != -1 and reg not in self.volatileRegisters:
+            self.shadow[reg] = b
+        return b
+
+    def updateShadow(self, reg, value):
+        if self.shadow is None or reg in self.volatileRegisters:
+            return
+        self.shadow[reg] = value & ~self.selfClearingBits.get(reg, 0) & 0xFF
+
     def reverseByteOrder(self, data):
         # Reverses the byte order of an int (16-bit) or long (32-bit) value
         # Courtesy Vishal Sapre
@@ -36,7 +112,7 @@ class PyComms:
         return data
     
     def writeBit(self, reg, bitNum, data):
-        b = self.readU8(reg)
+        b = self.readShadowed(reg)
         
         if data != 0:
             b = (b | (1 << bitNum))
@@ -69,7 +145,7 @@ class PyComms:
         # 10100011 original & ~mask
         # 10101011 masked | value
         
-        b = self.readU8(reg)
+        b = self.readShadowed(reg)
         mask = ((1 << length) - 1) << (bitStart - length + 1)
         data <<= (bitStart - length + 1)
         data &= mask
@@ -78,38 +154,69 @@ class PyComms:
             
         return self.write8(reg, b)
 
-    def readBytes(self, reg, length):
-        output = []
-        
-        i = 0
-        while i < length:
-            output.append(self.readU8(reg))
-            i += 1
-            
-        return output        
-        
-    def readBytesListU(self, reg, length):
+    def readBlock(self, reg, length, autoIncrement = True):
+        # Reads length bytes in as few bus transactions as possible. With
+        # autoIncrement the register pointer advances through consecutive
+        # registers, without it every byte comes from reg (e.g. FIFO_R_W)
+        if self.rawDevice is not None and length > self.MAX_BLOCK_LENGTH:
+            output = self.readRaw(reg, length)
+            if output != -1:
+                return output
+
         output = []
-        
-        i = 0
-        while i < length:
-            output.append(self.readU8(reg + i))
-            i += 1
-            
+        try:
+            while len(output) < length:
+                chunk = min(length - len(output), self.MAX_BLOCK_LENGTH)
+                if autoIncrement:
+                    chunkReg = reg + len(output)
+                else:
+                    chunkReg = reg
+                output.extend(self.bus.read_i2c_block_data(self.address, chunkReg, chunk))
+        except (IOError):
+            print ("Error accessing 0x%02X: Check your I2C address" % self.address)
+            return -1
+
         return output
 
+    def readRaw(self, reg, length):
+        # Reads length bytes in a single transfer through /dev/i2c-N, which
+        # is not limited to the 32 byte SMBus block size
+        try:
+            os.write(self.rawDevice, bytearray([reg]))
+            return list(bytearray(os.read(self.rawDevice, length)))
+        except (IOError, OSError):
+            print ("Error accessing 0x%02X: Check your I2C address" % self.address)
+            return -1
+
+    def openRawDevice(self, busNumber):
+        # Enables raw reads for block lengths beyond MAX_BLOCK_LENGTH
+        try:
+            # only on Linux, the rest of this module works anywhere
+            import fcntl
+            self.rawDevice = os.open("/dev/i2c-%d" % busNumber, os.O_RDWR)
+            fcntl.ioctl(self.rawDevice, self.I2C_SLAVE, self.address)
+        except (ImportError, IOError, OSError):
+            print ("Error opening /dev/i2c-%d, using block reads" % busNumber)
+            self.rawDevice = None
+
+    def readBytes(self, reg, length):
+        return self.readBlock(reg, length, False)
+
+    def readBytesListU(self, reg, length):
+        return self.readBlock(reg, length)
+
     def readBytesListS(self, reg, length):
-        output = []
-        
-        i = 0
-        while i < length:
-            output.append(self.readS8(reg + i))
-            i += 1
-            
-        return output        
+        output = self.readBlock(reg, length)
+        if output == -1:
+            return output
+
+        return [b - 256 if b > 127 else b for b in output]
     
     def writeList(self, reg, list):
         # Writes an array of bytes using I2C format"
+        if self.shadow is not None:
+            for i in range(len(list)):
+                self.invalidateShadow(reg + i)
         try:
             self.bus.write_i2c_block_data(self.address, reg, list)
         except (IOError):
@@ -122,7 +229,9 @@ class PyComms:
             self.bus.write_byte_data(self.address, reg, value)
         except (IOError):
             print ("Error accessing 0x%02X: Check your I2C address" % self.address)
+            self.invalidateShadow(reg)
             return -1
+        self.updateShadow(reg, value)
 
     def readU8(self, reg):
         # Read an unsigned byte from the I2C device